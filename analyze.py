@@ -1,118 +1,232 @@
 import json
 import pandas as pd
+import numpy as np
 import os
-import math
+import sys
 import glob
+import click
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
+import matplotlib
+matplotlib.use("Agg")  # render straight to files, no display needed
+import matplotlib.pyplot as plt
 
-# Function to parse JSON results file
-def parse_results(filepath):
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+from utils import ResultsManager, ExperimentAccumulator, ExperimentConfig, Statistics
+
+# raw result column -> name of the summary entry in a results file
+METRICS = ExperimentAccumulator.METRICS
+GROUP_KEYS = ["protocol", "concurrency", "size", "direction"]
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+CI_Z = 1.96  # 95% confidence interval, normal approximation
+
+CACHE_DIR = os.path.join(current_dir, ".analysis_cache")
+CACHE_VERSION = 2  # bump when the parsed DataFrames change shape
+GRAPHS_DIR = "analysis_graphs"  # next to results.xlsx
+CDF_POINTS = 1000  # points per latency CDF curve, however many samples there are
+
+SIZE_LABELS = ExperimentConfig.get_size_labels()  # bytes -> label, smallest first
+
+def size_label(file_name, file_size):
+    if file_size in SIZE_LABELS:
+        return SIZE_LABELS[file_size]
+    return file_name.split('_', 1)[-1]
+
+# Function to load one results file into per-file summaries and raw samples
+def load_result_file(filepath):
+    """Return (summaries, samples) DataFrames for one results file.
+
+    summaries has one row per file entry with its exact count, mean and
+    standard deviation; samples has one row per stored raw result. Older
+    files that embed raw_results inline are read as well.
+    """
     try:
         with open(filepath, 'r') as f:
             data = json.load(f)
-        
-        protocol = data.get('protocol', 'Unknown')
-        file_prefix = data.get('file_prefix', 'Unknown')
-        
-        results = {}
-        
-        for file_size, file_data in data.get('files', {}).items():
-            results[file_size] = {
-                'transfer_time': file_data['transfer_time'],
-                'throughput': file_data['throughput_bps'],
-                'overhead_ratio': file_data['overhead_ratio']
-            }
-        
-        return results, protocol, file_prefix
     except Exception as e:
         print(f"Error parsing {filepath}: {e}")
-        return {}, "Unknown", "Unknown"
-
-# Function to merge data from multiple result files for the same protocol
-def merge_protocol_results(file_results):
-    """Merge results from different files (A and B) for the same protocol"""
-    if not file_results:
-        return {}
+        return pd.DataFrame(), pd.DataFrame()
     
-    # Start with the first file's results
-    merged_data = {}
+    protocol = data.get('protocol', 'Unknown')
+    if data.get('mode', 'sequential') != 'sequential':
+        protocol = f"{protocol} {data['mode']}"
+    labels = {
+        "protocol": protocol,
+        "concurrency": data.get('concurrency', 1),
+        "direction": f"{data.get('file_prefix', 'Unknown')} from {data.get('server', 'Unknown')}",
+    }
     
-    # Get all unique file sizes from all results
-    all_file_sizes = set()
-    for result in file_results:
-        all_file_sizes.update(result.keys())
+    table = ResultsManager.load_raw_results(filepath) if "raw_results_dir" in data else None
     
-    # Process each file size
-    for file_name in all_file_sizes:
-        # Extract the size part (e.g., "10kB") by removing the prefix
-        if '_' in file_name:
-            base_size = file_name.split('_')[1]
-        else:
-            base_size = file_name
+    summaries = []
+    samples = []
+    for file_name, file_data in data.get('files', {}).items():
+        size = size_label(file_name, file_data.get('file_size_bytes'))
+        row = {**labels, "size": size, "file_size": file_data.get('file_size_bytes'),
+               "n": file_data['repetitions_completed']}
+        for metric, key in METRICS.items():
+            row[f"{metric}_mean"] = file_data[key]['mean']
+            row[f"{metric}_std"] = file_data[key]['stddev']
+        summaries.append(row)
         
-        base_size_conversion = {
-            '10240': '10kB',
-            '102400': '100kB',
-            '1048576': '1MB',
-            '10485760': '10MB'
-        }
+        if table is not None:
+            start, stop = file_data['raw_results_rows']
+            columns = {metric: table[metric][start:stop] for metric in METRICS if metric in table}
+            raw = pd.DataFrame(columns)
+        else:
+            raw = pd.DataFrame([{metric: r.get(metric) for metric in METRICS}
+                                for r in file_data.get('raw_results', [])])
+        if len(raw):
+            samples.append(raw.assign(size=size, **labels))
+    
+    samples = pd.concat(samples, ignore_index=True) if samples else pd.DataFrame()
+    return pd.DataFrame(summaries), samples
 
-        # Skip if base_size is not in the expected format
-        if base_size not in ['10kB', '100kB', '1MB', '10MB']:
-            base_size = base_size_conversion[base_size]
-        
-        if base_size not in ['10kB', '100kB', '1MB', '10MB']:
-            continue
-            
-        # Find all results for this file size across different result files
-        size_results = []
-        for result in file_results:
-            # Look for exact match or any match with this base size
-            if file_name in result:
-                size_results.append(result[file_name])
-            else:
-                # Try to find any key that contains this base size
-                for key in result:
-                    if base_size in key:
-                        size_results.append(result[key])
-                        break
-        
-        if not size_results:
-            continue
-        
-        # Initialize data for this file size
-        merged_data[base_size] = {}
-        
-        # Merge metrics
-        for metric in ['transfer_time', 'throughput', 'overhead_ratio']:
-            # Get all available values for this metric
-            means = [r[metric]['mean'] for r in size_results if r[metric]['mean'] != 0]
-            stddevs = [r[metric]['stddev'] for r in size_results if r[metric]['stddev'] != 0]
-            
-            if means:
-                # Average of means
-                combined_mean = sum(means) / len(means)
-                
-                # Combined standard deviation
-                if stddevs and any(s > 0 for s in stddevs):
-                    # Using propagation of uncertainty formula for combined measurements
-                    combined_stddev = math.sqrt(sum(s**2 for s in stddevs) / len(stddevs))
-                else:
-                    combined_stddev = 0
-                
-                merged_data[base_size][metric] = {
-                    'mean': combined_mean,
-                    'stddev': combined_stddev
-                }
-            else:
-                merged_data[base_size][metric] = {'mean': 0, 'stddev': 0}
+def cache_key(filepath):
+    """Identifies the contents of a results file and its raw sample columns by size and mtime.
+
+    Only stats the files, so an unchanged file is never parsed; the raw sample
+    columns are in the _raw directory next to it, which older inline files do not have.
+    """
+    stats = [os.stat(filepath)]
+    raw_dirpath = ResultsManager.raw_dirpath(filepath)
+    if os.path.isdir(raw_dirpath):
+        stats += [os.stat(os.path.join(raw_dirpath, name)) for name in sorted(os.listdir(raw_dirpath))]
+    return f"{CACHE_VERSION}:" + ":".join(f"{st.st_size}:{st.st_mtime_ns}" for st in stats)
+
+def cache_path(filepath, cache_dir):
+    name = hashlib.sha256(os.path.abspath(filepath).encode()).hexdigest()
+    return os.path.join(cache_dir, f"{name}.pkl")
+
+def read_cache(filepath, cache_dir):
+    try:
+        key, loaded = pd.read_pickle(cache_path(filepath, cache_dir))
+    except Exception:
+        return None
+    return loaded if key == cache_key(filepath) else None
+
+def write_cache(filepath, cache_dir, loaded):
+    os.makedirs(cache_dir, exist_ok=True)
+    pd.to_pickle((cache_key(filepath), loaded), cache_path(filepath, cache_dir))
+
+def load_results(result_files, workers=None, cache_dir=CACHE_DIR):
+    """Load result files in parallel, reusing cached DataFrames for unchanged files."""
+    loaded = {}
+    if cache_dir:
+        for filepath in result_files:
+            cached = read_cache(filepath, cache_dir)
+            if cached is not None:
+                loaded[filepath] = cached
+    
+    pending = [filepath for filepath in result_files if filepath not in loaded]
+    if pending:
+        print(f"Parsing {len(pending)} result files ({len(loaded)} cached)...")
+        if workers == 1 or len(pending) == 1:
+            parsed = list(map(load_result_file, pending))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parsed = list(executor.map(load_result_file, pending))
+        for filepath, result in zip(pending, parsed):
+            loaded[filepath] = result
+            if cache_dir and not result[0].empty:
+                write_cache(filepath, cache_dir, result)
+    
+    loaded = [loaded[filepath] for filepath in result_files]
+    if not loaded:
+        return pd.DataFrame(), pd.DataFrame()
+    summaries = pd.concat([summary for summary, _ in loaded], ignore_index=True)
+    samples = pd.concat([raw for _, raw in loaded], ignore_index=True)
+    for key in GROUP_KEYS:
+        if key in samples:
+            samples[key] = samples[key].astype("category")
+    return summaries, samples
+
+def pooled_statistics(summaries, keys):
+    """Exact pooled count, mean, standard deviation and 95% CI per group.
+
+    Combines the per-file summaries with the parallel variance formula, so
+    the result is the same as computing over every repetition at once.
+    """
+    by = [summaries[key] for key in keys]
+    n = summaries["n"]
+    total = n.groupby(by).transform("sum")
+    
+    parts = {"n": n}
+    for metric in METRICS:
+        mean = summaries[f"{metric}_mean"]
+        std = summaries[f"{metric}_std"]
+        pooled_mean = (n * mean).groupby(by).transform("sum") / total
+        parts[f"{metric}_mean"] = pooled_mean
+        parts[f"{metric}_m2"] = (n - 1) * std ** 2 + n * (mean - pooled_mean) ** 2
     
-    return merged_data
+    aggregations = {"n": "sum", **{f"{metric}_mean": "first" for metric in METRICS},
+                    **{f"{metric}_m2": "sum" for metric in METRICS}}
+    stats = pd.DataFrame(parts).groupby(by).agg(aggregations)
+    stats.index.names = keys
+    
+    for metric in METRICS:
+        m2 = stats.pop(f"{metric}_m2")
+        stats[f"{metric}_std"] = np.sqrt(m2 / (stats["n"] - 1)).where(stats["n"] > 1, 0.0)
+        half_width = CI_Z * stats[f"{metric}_std"] / np.sqrt(stats["n"])
+        stats[f"{metric}_ci95_low"] = stats[f"{metric}_mean"] - half_width
+        stats[f"{metric}_ci95_high"] = stats[f"{metric}_mean"] + half_width
+    return stats
+
+def sample_percentiles(samples, keys):
+    """Percentiles of the raw samples per group."""
+    if samples.empty:
+        return pd.DataFrame()
+    
+    quantiles = samples.groupby(keys, observed=True)[list(METRICS)].quantile(list(PERCENTILES.values()))
+    quantiles = quantiles.unstack()
+    names = {q: name for name, q in PERCENTILES.items()}
+    quantiles.columns = [f"{metric}_{names[q]}" for metric, q in quantiles.columns]
+    return quantiles
+
+def sample_robust_statistics(samples, keys):
+    """Median, MAD and trimmed mean of the raw samples per group."""
+    if samples.empty:
+        return pd.DataFrame()
+    
+    groups = samples.groupby(keys, observed=True)
+    columns = {}
+    for metric in METRICS:
+        robust = groups[metric].apply(lambda values: pd.Series(Statistics.robust_statistics(values))).unstack()
+        for name in robust.columns:
+            columns[f"{metric}_{name}"] = robust[name]
+    return pd.DataFrame(columns)
+
+def analyze_results(summaries, samples, keys):
+    stats = pooled_statistics(summaries, keys)
+    for sample_stats in (sample_percentiles(samples, keys), sample_robust_statistics(samples, keys)):
+        if not sample_stats.empty:
+            stats = stats.join(sample_stats)
+    stats = stats.reset_index()
+    if "size" in keys:
+        stats["file_size"] = stats["size"].map(summaries.groupby("size")["file_size"].max())
+    # numeric size order, not 100kB, 10MB, 10kB, 1MB
+    order = [column for column in ["file_size", "protocol", "concurrency", "direction"] if column in stats.columns]
+    return stats.sort_values(order, kind="stable").reset_index(drop=True)
+
+def protocol_label(row):
+    return row['protocol'] if row['concurrency'] == 1 else f"{row['protocol']} c{row['concurrency']}"
+
+def protocol_table(stats):
+    """Arrange statistics as {protocol: {size: {metric: {mean, stddev}}}} for create_excel."""
+    protocol_data = {}
+    for row in stats.to_dict('records'):
+        protocol_data.setdefault(protocol_label(row), {})[row['size']] = {
+            metric: {'mean': row[f"{metric}_mean"], 'stddev': row[f"{metric}_std"]}
+            for metric in METRICS
+        }
+    return protocol_data
 
 # Function to create excel from the data
-def create_excel(protocol_data, output_filename="results.xlsx"):
+def create_excel(protocol_data, output_filename="results.xlsx", statistics=None):
     # Get all available protocols
     protocols = list(protocol_data.keys())
     
@@ -129,7 +243,7 @@ def create_excel(protocol_data, output_filename="results.xlsx"):
         file_sizes.update(protocol_data[protocol].keys())
     
     # Sort file sizes in logical order
-    size_order = {"10kB": 0, "100kB": 1, "1MB": 2, "10MB": 3}
+    size_order = {label: i for i, label in enumerate(SIZE_LABELS.values())}
     file_sizes = sorted(list(file_sizes), key=lambda x: size_order.get(x, 99))
     
     # Prepare data for each metric
@@ -240,38 +354,120 @@ def create_excel(protocol_data, output_filename="results.xlsx"):
             for row in range(1, len(file_sizes) + 2):
                 for col in range(1, len(columns) + 2):
                     sheet.cell(row=row, column=col).border = thin_border
+        
+        # Full per-direction breakdown with CIs and percentiles
+        if statistics is not None:
+            statistics.to_excel(writer, sheet_name='Statistics', index=False)
     
     print(f"Excel file created: {output_filename}")
 
-def main():
-    # Find all result JSON files
-    result_files = glob.glob("**/results_*_from_*_*.json")
+# Functions to render the graphs; each one draws and saves a single figure
+def plot_throughput(protocol, stats, path):
+    stats = stats.sort_values("file_size")
+    mean = stats["throughput_mean"] / 1000
+    std = stats["throughput_std"] / 1000
+    
+    fig, ax = plt.subplots(figsize=(8, 6))
+    ax.plot(stats["size"], mean, marker='o', color='blue', label='Throughput')
+    ax.fill_between(stats["size"], mean - std, mean + std, color='blue', alpha=0.2, label='Std Dev Range')
+    ax.set_title(f"Throughput vs File Size for {protocol.replace('/', ' ')}")
+    ax.set_xlabel("File Size")
+    ax.set_ylabel("Throughput (kbps)")
+    ax.grid(True, linestyle='--', alpha=0.6)
+    ax.legend()
+    fig.savefig(path, dpi=150, bbox_inches='tight')
+    plt.close(fig)
+
+def plot_latency_cdf(curves, sizes, path):
+    fig, axes = plt.subplots(1, len(sizes), figsize=(5 * len(sizes), 4), squeeze=False)
+    for ax, size in zip(axes[0], sizes):
+        for protocol, (values, fractions) in curves.get(size, {}).items():
+            ax.plot(values * 1000, fractions, label=protocol)
+        ax.set_xscale('log')
+        ax.set_title(size)
+        ax.set_xlabel("Transfer time (ms)")
+        ax.grid(True, linestyle='--', alpha=0.6)
+    axes[0][0].set_ylabel("Fraction of transfers")
+    axes[0][0].legend()
+    fig.suptitle("Transfer Time CDF")
+    fig.savefig(path, dpi=150, bbox_inches='tight')
+    plt.close(fig)
+
+def plot_overhead_ratio(table, path):
+    fig, ax = plt.subplots(figsize=(8, 6))
+    table.plot.bar(ax=ax, rot=0)
+    ax.set_title("Overhead Ratio vs File Size")
+    ax.set_xlabel("File Size")
+    ax.set_ylabel("Total data / file size")
+    ax.set_ylim(bottom=min(1.0, table.min().min()) * 0.99)
+    ax.grid(True, axis='y', linestyle='--', alpha=0.6)
+    ax.legend(title="Protocol")
+    fig.savefig(path, dpi=150, bbox_inches='tight')
+    plt.close(fig)
+
+def cdf_curves(samples):
+    """Latency CDF per size and protocol, reduced to CDF_POINTS quantiles per curve."""
+    curves = {}
+    fractions = np.linspace(0, 1, CDF_POINTS)
+    labels = samples["protocol"].astype(str).where(samples["concurrency"] == 1,
+        samples["protocol"].astype(str) + " c" + samples["concurrency"].astype(str))
+    for (size, protocol), values in samples["transfer_time"].groupby([samples["size"], labels], observed=True):
+        values = values.dropna().to_numpy()
+        if len(values):
+            curves.setdefault(size, {})[protocol] = (np.quantile(values, fractions), fractions)
+    return curves
+
+def create_graphs(combined, samples, output_dir=GRAPHS_DIR, workers=None):
+    """Render every figure in its own process and return the written paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    combined = combined.assign(label=combined.apply(protocol_label, axis=1)).sort_values("file_size")
+    sizes = list(dict.fromkeys(combined["size"]))
     
-    print(f"Found {len(result_files)} result files:")
-    for file in result_files:
-        print(f" - {file}")
+    jobs = []
+    for protocol, stats in combined.groupby("label", sort=False):
+        path = os.path.join(output_dir, f"Throughput vs File Size for {protocol.replace('/', ' ')}.png")
+        jobs.append((plot_throughput, (protocol, stats, path)))
+    if not samples.empty:
+        path = os.path.join(output_dir, "Transfer Time CDF.png")
+        jobs.append((plot_latency_cdf, (cdf_curves(samples), sizes, path)))
+    overhead = combined.pivot(index="size", columns="label", values="overhead_ratio_mean").reindex(sizes)
+    jobs.append((plot_overhead_ratio, (overhead, os.path.join(output_dir, "Overhead Ratio vs File Size.png"))))
     
-    # Group files by protocol
-    protocol_files = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(plot, *args) for plot, args in jobs]
+        for future in futures:
+            future.result()
+    return [args[-1] for _, args in jobs]
+
+@click.command()
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help='Processes used to parse result files (default: one per CPU)')
+@click.option('--cache/--no-cache', default=True, show_default=True,
+              help='Reuse parsed results of unchanged files from .analysis_cache/')
+@click.option('--graphs/--no-graphs', default=True, show_default=True,
+              help='Render throughput, latency CDF and overhead ratio graphs into analysis_graphs/')
+def main(workers, cache, graphs):
+    # Find all result JSON files, in the project root or any subdirectory
+    result_files = sorted(glob.glob("**/results_*_from_*_*.json", recursive=True))
     
-    for file in result_files:
-        file_data, protocol, prefix = parse_results(file)
-        
-        if protocol not in protocol_files:
-            protocol_files[protocol] = []
-        
-        protocol_files[protocol].append(file_data)
-    from pprint import pprint
-    pprint(protocol_files)
+    print(f"Found {len(result_files)} result files")
     
-    # Merge results for each protocol
-    protocol_data = {}
+    summaries, samples = load_results(result_files, workers, CACHE_DIR if cache else None)
+    if summaries.empty:
+        print("No results to analyze.")
+        return
+    print(f"Loaded {len(samples)} raw samples from {len(summaries)} experiments")
     
-    for protocol, file_results in protocol_files.items():
-        print(f"Merging {len(file_results)} files for {protocol}...")
-        protocol_data[protocol] = merge_protocol_results(file_results)
+    # Directions (A and B) are pooled for the per-protocol sheets
+    statistics = analyze_results(summaries, samples, GROUP_KEYS)
+    combined = analyze_results(summaries, samples, ["protocol", "concurrency", "size"])
     
     # Create Excel file
-    create_excel(protocol_data)
+    create_excel(protocol_table(combined), statistics=statistics)
+    
+    if graphs:
+        for path in create_graphs(combined, samples, workers=workers):
+            print(f"Graph created: {os.path.relpath(path)}")
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from contextlib import contextmanager
+
+import click
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+from utils import ExperimentConfig, ExperimentSpec, Processes
+
+manifest = ExperimentConfig.load_file_manifest()
+
+FILES_DIR = os.path.join(current_dir, "files")
+
+def network_name(network):
+    """Machine name for results measured through the emulated network, e.g. local-rtt50ms-bw10Mbps."""
+    parts = ["local"]
+    if network["rtt"]:
+        parts.append(f"rtt{network['rtt']:g}ms")
+    if network["jitter"]:
+        parts.append(f"jitter{network['jitter']:g}ms")
+    if network["bandwidth"]:
+        parts.append(f"bw{network['bandwidth']:g}Mbps")
+    if network["loss"]:
+        parts.append(f"loss{network['loss']:g}")
+    return "-".join(parts)
+
+@contextmanager
+def emulated_network(port, network, log_path, env):
+    """Put netem.py in front of port when any network condition is set; yields the port to connect to."""
+    if network_name(network) == "local":
+        yield port
+        return
+    
+    proxy_port = Processes.free_port()
+    command = [sys.executable, os.path.join(current_dir, "netem.py"), "--port", str(proxy_port),
+               "--target", f"127.0.0.1:{port}", "--rtt", str(network["rtt"]), "--jitter", str(network["jitter"]),
+               "--loss", str(network["loss"])]
+    if network["bandwidth"]:
+        command += ["--bandwidth", str(network["bandwidth"])]
+    with Processes.running(command, log_path, env) as process:
+        Processes.wait_for_port(proxy_port, process)
+        yield proxy_port
+
+def generate_files(prefixes, sizes, env):
+    """Create any test file the run needs that is missing from files/."""
+    command = [sys.executable, os.path.join(current_dir, "generate_files.py")]
+    command += [arg for prefix in prefixes for arg in ("--prefix", prefix)]
+    command += [arg for size in sizes for arg in ("--size", size)]
+    subprocess.run(command, env=env, check=True)
+
+def run_http(protocol_dir, prefixes, scale, sizes, spec_path, warmup, network, output_dir, log_dir, env):
+    port = Processes.free_port()
+    server = [sys.executable, os.path.join(current_dir, protocol_dir, "server.py"), "--port", str(port)]
+    server_name = network_name(network)
+
+    with Processes.running(server, os.path.join(log_dir, f"{protocol_dir}_server.log"), env) as process:
+        Processes.wait_for_port(port, process)
+        with emulated_network(port, network, os.path.join(log_dir, f"{protocol_dir}_netem.log"), env) as client_port:
+            client = [sys.executable, os.path.join(current_dir, protocol_dir, "client.py"), "--server", server_name,
+                      "--port", str(client_port), "--scale", str(scale), "--output-dir", output_dir]
+            client += [arg for size in sizes for arg in ("--size", size)]
+            if spec_path:
+                client += ["--spec", spec_path]
+            if warmup is not None:
+                client += ["--warmup", str(warmup)]
+            for prefix in prefixes:
+                click.echo(click.style(f"\n{protocol_dir}: {prefix} files from {server_name} (127.0.0.1:{client_port})",
+                                       fg='cyan', bold=True))
+                subprocess.run(client + ["--file", prefix], env=env, check=True)
+
+def run_bittorrent(scale, sizes, spec_path, reuse_session, leechers, seeders, output_dir, env):
+    swarm = os.path.join(current_dir, "bitTorrent", "swarm.py")
+    spec = ExperimentSpec.load(spec_path, "bittorrent")
+    for exp in spec.experiments(scale, sizes):
+        file_path = os.path.join(FILES_DIR, f"A_{exp['size']}")
+        if not os.path.isfile(file_path):
+            click.echo(click.style(f"Skipping BitTorrent {exp['size']}: {file_path} does not exist", fg='yellow'))
+            continue
+        # a spec gives the rounds per leecher; the manifest counts downloads, and
+        # every leecher downloads the file in each round
+        runs = exp['repetitions'] if spec.sizes is not None else max(1, round(exp['repetitions'] / leechers))
+
+        click.echo()
+        command = [sys.executable, swarm, file_path, "--leechers", str(leechers), "--seeders", str(seeders),
+                   "--runs", str(runs), "--output-dir", output_dir]
+        if reuse_session:
+            command.append("--reuse-session")
+        subprocess.run(command, env=env, check=True)
+
+@click.command()
+@click.option('--protocol', 'protocols', type=click.Choice(['http1.1', 'http2', 'bittorrent']), multiple=True,
+              help='Protocols to benchmark (repeatable, default: all)')
+@click.option('--file', 'prefixes', type=click.Choice(manifest["prefixes"]), multiple=True,
+              help='File prefixes the HTTP clients request (repeatable, default: A and B)')
+@click.option('--size', 'sizes', type=click.Choice([size["label"] for size in manifest["sizes"]]), multiple=True,
+              help='File sizes to run (repeatable, default: every non-optional size in files/manifest.json)')
+@click.option('--scale', type=click.FloatRange(min=0, min_open=True), default=1.0, show_default=True,
+              help='Multiply the number of repetitions of every file size (at least 1 each)')
+@click.option('--output-dir', type=click.Path(file_okay=False), default="bench_results", show_default=True,
+              help='Directory the results files are written to')
+@click.option('--rtt', type=click.FloatRange(min=0), default=0.0, show_default=True,
+              help='Emulated round-trip time in milliseconds (HTTP protocols only)')
+@click.option('--jitter', type=click.FloatRange(min=0), default=0.0, show_default=True,
+              help='Emulated extra random round-trip delay in milliseconds (HTTP protocols only)')
+@click.option('--bandwidth', type=click.FloatRange(min=0, min_open=True), default=None,
+              help='Emulated bandwidth cap in Mbit/s (HTTP protocols only)')
+@click.option('--loss', type=click.FloatRange(min=0, max=1, max_open=True), default=0.0, show_default=True,
+              help='Emulated packet loss probability (HTTP protocols only)')
+@click.option('--spec', 'spec_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Experiment spec file passed to every client (protocols default to the ones it lists)')
+@click.option('--warmup', type=click.IntRange(min=0), default=None,
+              help='Untimed downloads of each file before the measured ones (HTTP protocols only)')
+@click.option('--reuse-session', is_flag=True, default=False,
+              help='BitTorrent clients keep one libtorrent session for all their runs')
+@click.option('--leechers', type=click.IntRange(min=1), default=3, show_default=True,
+              help='BitTorrent clients in the local swarm (3 as in the VM setup)')
+@click.option('--seeders', type=click.IntRange(min=1), default=1, show_default=True,
+              help='BitTorrent seeders in the local swarm')
+def main(protocols, prefixes, sizes, scale, output_dir, rtt, jitter, bandwidth, loss, spec_path, warmup, reuse_session,
+         leechers, seeders):
+    """Run the experiments of every protocol against local servers over loopback."""
+    if spec_path:
+        spec_path = os.path.abspath(spec_path)
+    protocols = protocols or ExperimentSpec.load(spec_path).protocols
+    prefixes = prefixes or manifest["prefixes"]
+    network = {"rtt": rtt, "jitter": jitter, "bandwidth": bandwidth, "loss": loss}
+    output_dir = os.path.abspath(output_dir)
+    log_dir = os.path.join(output_dir, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+
+    # the clients resolve --server local through this machines file
+    machines_path = os.path.join(log_dir, "machines.json")
+    with open(machines_path, 'w') as f:
+        json.dump({"local": "127.0.0.1", network_name(network): "127.0.0.1"}, f)
+    env = {**os.environ, "MACHINES_CONFIG": machines_path, "PYTHONUNBUFFERED": "1"}
+
+    start = time.monotonic()
+    # the BitTorrent swarm always shares the A files
+    needed = set(prefixes) | ({'A'} if 'bittorrent' in protocols else set())
+    needed_sizes = {exp["size"] for protocol in protocols
+                    for exp in ExperimentSpec.load(spec_path, protocol).experiments(sizes=sizes)}
+    generate_files(sorted(needed), sorted(needed_sizes), env)
+    for protocol in protocols:
+        if protocol == 'bittorrent':
+            if network_name(network) != "local":
+                click.echo(click.style("BitTorrent peers connect to each other directly, "
+                                       "so it runs without network emulation", fg='yellow'))
+            run_bittorrent(scale, sizes, spec_path, reuse_session, leechers, seeders, output_dir, env)
+        else:
+            run_http(protocol, prefixes, scale, sizes, spec_path, warmup, network, output_dir, log_dir, env)
+
+    click.echo(click.style(f"\nBenchmark finished in {time.monotonic() - start:.1f}s. "
+                           f"Results are in {output_dir}; run analyze.py there to compare them.",
+                           fg='bright_green', bold=True))
+
+if __name__ == "__main__":
+    main()
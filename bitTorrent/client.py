@@ -4,6 +4,7 @@ import time
 import csv
 import socket
 import shutil
+import click
 import requests
 from statistics import mean, stdev
 
@@ -12,64 +13,140 @@ import libtorrent as lt
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir)
-from utils import ProgressDisplay
+from utils import ProgressDisplay, PhaseTimer, ResultsLog, ExperimentSpec
+from settings import session_settings
 
-def run_download(magnet_link, run_number, results):
+REMOVE_TIMEOUT = 30
+READY_TIMEOUT = 30  # seconds the seeder may hold a /ready request open
+ANNOUNCE_TIMEOUT = 5
+ALERT_WAIT_MS = 1000  # wait_for_alert returns as soon as an alert is posted, this only bounds each wait
+
+def create_session(listen_port=6881, client_id=None):
+    return lt.session(session_settings(listen_port, lt.alert.category_t.error_notification |
+                                       lt.alert.category_t.status_notification |
+                                       lt.alert.category_t.storage_notification |
+                                       lt.alert.category_t.piece_progress_notification |
+                                       lt.alert.category_t.tracker_notification, client_id))
+
+def remove_torrent(ses, handle):
+    """Remove the torrent and delete its files, and wait until the session has let go of them."""
+    handle.flush_cache()
+    ses.remove_torrent(handle, lt.session.delete_files)
+    deadline = time.monotonic() + REMOVE_TIMEOUT
+    while time.monotonic() < deadline:
+        ses.wait_for_alert(1000)
+        for alert in ses.pop_alerts():
+            if isinstance(alert, (lt.torrent_deleted_alert, lt.torrent_delete_failed_alert)):
+                return
+    print(f"Torrent still not removed after {REMOVE_TIMEOUT}s")
+
+def wait_for_download(ses, handle, timer):
+    """Mark connect, first_byte and body_complete as soon as the torrent's alerts are posted.
+
+    connect ends when the metadata arrives, first_byte when the first piece
+    is verified and body_complete when the torrent finishes. Returns when
+    the first tracker announce was sent and how long its reply took, both
+    None when they have not happened yet.
+    """
+    announce_sent = announce_time = None
+    while True:
+        ses.wait_for_alert(ALERT_WAIT_MS)
+        for alert in ses.pop_alerts():
+            if not isinstance(alert, lt.torrent_alert) or alert.handle != handle:
+                continue
+            if isinstance(alert, lt.tracker_announce_alert) and announce_sent is None:
+                announce_sent = time.perf_counter_ns()
+            elif isinstance(alert, lt.tracker_reply_alert) and announce_sent is not None and announce_time is None:
+                announce_time = (time.perf_counter_ns() - announce_sent) / 1e9
+            elif isinstance(alert, lt.metadata_received_alert):
+                timer.mark("connect")
+            elif isinstance(alert, lt.piece_finished_alert) and "first_byte" not in timer.marks:
+                timer.mark("first_byte")
+            elif isinstance(alert, lt.torrent_finished_alert):
+                timer.mark("body_complete")
+                return announce_sent, announce_time
+
+def wait_for_announce(ses, handle, announce_sent, timeout=ANNOUNCE_TIMEOUT):
+    """Latency of an announce still waiting for its reply when the download finished."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ses.wait_for_alert(ALERT_WAIT_MS)
+        for alert in ses.pop_alerts():
+            if isinstance(alert, lt.tracker_reply_alert) and alert.handle == handle:
+                return (time.perf_counter_ns() - announce_sent) / 1e9
+    return None
+
+def run_download(magnet_link, run_number, results, listen_port=6881, ses=None, client_id=None):
     # print(f"\n=== Starting download run {run_number} ===")
     download_path = "./downloads"
     os.makedirs(download_path, exist_ok=True)
     
-    ses = lt.session({'listen_interfaces': '0.0.0.0:6881'})
+    # connect covers peer discovery and the metadata exchange, plus session
+    # start-up unless a session is passed in to be reused across runs
+    timer = PhaseTimer()
+    reuse_session = ses is not None
+    if not reuse_session:
+        ses = create_session(listen_port, client_id)
     params = lt.parse_magnet_uri(magnet_link)
     params.save_path = download_path
     handle = ses.add_torrent(params)
+    added_ns = time.perf_counter_ns()
     
-    while not handle.status().has_metadata:
-        time.sleep(1)
-    
-    s = handle.status()
-    # print(f"Downloading {s.name} ({s.total_wanted} bytes)")
-    
-    start_time = time.time()
-    
-    while handle.status().progress < 1.0:
-        s = handle.status()
-        # print(f"\rProgress: {s.progress * 100:.2f}% (down: {s.download_rate / 1000:.1f} kB/s, peers: {s.num_peers})", end=' ')
-        sys.stdout.flush()
-        
-        time.sleep(1)
-    
-    end_time = time.time()
+    announce_sent, announce_time = wait_for_download(ses, handle, timer)
+    end_time = time.time()  # wall clock, compared with the other peers' times by the seeder
+    # a direct peer in the magnet link can finish the transfer before the tracker answers
+    if announce_time is None and announce_sent is not None:
+        announce_time = wait_for_announce(ses, handle, announce_sent)
     # print("\nDownload complete.")
     
+    # metadata exchange and payload transfer are timed separately
+    metadata_time = (timer.marks.get("connect", added_ns) - added_ns) / 1e9
     s = handle.status()
-    total_time = end_time - start_time
+    total_time = timer.elapsed("body_complete") - timer.elapsed("connect")
     file_size = s.total_payload_download
     total_data_transferred = s.total_download
     
     throughput = (file_size * 0.008) / total_time if total_time > 0 else 0
     overhead_file_ratio = total_data_transferred / file_size if file_size > 0 else 0
     
-    results.append((total_time, throughput, total_data_transferred, overhead_file_ratio))
+    if reuse_session:
+        remove_torrent(ses, handle)
+    else:
+        ses.pause()
+        del ses
+    timer.mark("teardown")
     
-    ses.pause()
-    del ses
-    return end_time
+    results.append({
+        "RTT": total_time,
+        "MetadataTime": metadata_time,
+        "AnnounceTime": announce_time,
+        "Throughput": throughput,
+        "TotalDataTransferred": total_data_transferred,
+        "OverheadFileRatio": overhead_file_ratio,
+        "phases": timer.phases()
+    })
+    # wall clock span of the payload transfer, reported to the seeder
+    return end_time - total_time, end_time
 
 def save_results(results, filename, runs):
+    phase_columns = [f"phase_{phase}" for phase in PhaseTimer.PHASES]
     with open(filename, 'w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(["RTT", "Throughput", "TotalDataTransferred", "OverheadFileRatio"])
-        writer.writerows(results)
+        writer.writerow(["RTT", "MetadataTime", "Throughput", "TotalDataTransferred", "OverheadFileRatio"] + phase_columns)
+        for r in results:
+            writer.writerow([r["RTT"], r["MetadataTime"], r["Throughput"], r["TotalDataTransferred"], r["OverheadFileRatio"]] +
+                            [r["phases"][phase] for phase in PhaseTimer.PHASES])
     
-    avg_rtt = mean([r[0] for r in results])
-    avg_throughput = mean([r[1] for r in results])
-    avg_total_data = mean([r[2] for r in results])
-    avg_overhead_ratio = mean([r[3] for r in results])
+    avg_rtt = mean([r["RTT"] for r in results])
+    avg_metadata_time = mean([r["MetadataTime"] for r in results])
+    avg_throughput = mean([r["Throughput"] for r in results])
+    avg_total_data = mean([r["TotalDataTransferred"] for r in results])
+    avg_overhead_ratio = mean([r["OverheadFileRatio"] for r in results])
     
-    throughput_std_dev = stdev([r[1] for r in results]) if runs > 1 else 0
+    throughput_std_dev = stdev([r["Throughput"] for r in results]) if runs > 1 else 0
     summary = {
         "RTT": avg_rtt,
+        "MetadataTime": avg_metadata_time,
         "Throughput": avg_throughput,
         "TotalDataTransferred": avg_total_data,
         "OverheadFileRatio": avg_overhead_ratio,
@@ -77,38 +154,70 @@ def save_results(results, filename, runs):
     }
     print("\nFinal Summary:", summary)
 
-def main():
-    ready_url = "http://192.168.98.129:8001/ready"
-    if len(sys.argv) != 3:
-        print("Usage: python client.py <magnet_link> <runs>")
-        sys.exit(1)
+@click.command()
+@click.argument('magnet_link')
+@click.argument('runs', type=click.IntRange(min=1), required=False)
+@click.option('--resume', is_flag=True, default=False,
+              help='Continue an interrupted run from its results log instead of starting over')
+@click.option('--seeder', default="http://192.168.98.129:8001", show_default=True,
+              help='Base URL of the seeder API')
+@click.option('--listen-port', type=int, default=6881, show_default=True,
+              help='Port the BitTorrent session listens on')
+@click.option('--client-id', default=socket.gethostname(), show_default='hostname',
+              help='Name this client reports to the seeder')
+@click.option('--output-dir', type=click.Path(file_okay=False), default=current_dir,
+              help='Directory the results log is written to (default: next to the client)')
+@click.option('--reuse-session/--no-reuse-session', default=False, show_default=True,
+              help='Keep one libtorrent session for all runs and add/remove the torrent per run')
+@click.option('--spec', 'spec_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Experiment spec file to take RUNS from, by the file size in the magnet link')
+def main(magnet_link, runs, resume, seeder, listen_port, client_id, output_dir, reuse_session, spec_path):
+    ready_url = f"{seeder}/ready"
     
-    magnet_link = sys.argv[1]
-    try:
-        runs = int(sys.argv[2])
-    except ValueError:
-        print("Error: runs must be an integer.")
-        sys.exit(1)
+    file_name = lt.parse_magnet_uri(magnet_link).name
+    if runs is None:
+        if spec_path is None:
+            raise click.UsageError("Give the number of RUNS or a --spec file")
+        # rounds are paced by the seeder, so only the repetitions of the spec apply here
+        size = file_name.split("_", 1)[-1]
+        runs = next((exp["repetitions"] for exp in ExperimentSpec.load(spec_path, "bittorrent").experiments()
+                     if exp["size"] == size), None)
+        if runs is None:
+            raise click.UsageError(f"{spec_path} has no repetitions for {size}")
+    os.makedirs(output_dir, exist_ok=True)
+    log_path = os.path.join(output_dir, f"results_{file_name}_{client_id}_bitTorrent_log.jsonl")
+    results = ResultsLog.read(log_path) if resume else []
+    results_log = ResultsLog(log_path, resume=resume, fsync_every=1)
+    # the peer id is derived from client_id, so the seeder can match this client's connections to its acks
+    ses = create_session(listen_port, client_id) if reuse_session else None
+    # one keep-alive connection to the seeder's API for every ack and /ready
+    api = requests.Session()
     
-    results = []
-    with ProgressDisplay.create_progress_bar("File", runs) as bar:
+    with ProgressDisplay.create_progress_bar(file_name, runs - len(results)) as bar:
         for run in bar:
-            end_time = run_download(magnet_link, run, results)
+            start_time, end_time = run_download(magnet_link, run, results, listen_port, ses, client_id)
+            results_log.append({"file_name": file_name, **results[-1]})
             # print("Sending ack to seeder...")
-            resp = requests.post("http://192.168.98.129:8001/ack", json={"client": socket.gethostname(), "time": end_time})
+            resp = api.post(f"{seeder}/ack", json={"client": client_id, "start": start_time, "time": end_time})
+            # the seeder holds /ready open until the next round starts, or for READY_TIMEOUT
             while True:
                 try:
-                    response = requests.get(ready_url, params={"client": socket.gethostname()})
+                    response = api.get(ready_url, params={"client": client_id, "timeout": READY_TIMEOUT},
+                                       timeout=READY_TIMEOUT + 10)
                     data = response.json()
                     if data.get("ready", False):
                         break
                 except requests.exceptions.JSONDecodeError:
                     print("Received invalid JSON from /ready, retrying...")
-                time.sleep(0.1)
+                    time.sleep(0.1)
             
             # print("Deleting downloads folder...")
             shutil.rmtree("./downloads", ignore_errors=True)
-            time.sleep(2)
+            if not reuse_session:
+                # give the next session time to bind the listen port again
+                time.sleep(2)
+    api.close()
+    results_log.close()
     
 
 if __name__ == "__main__":
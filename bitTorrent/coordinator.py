@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+from fastapi import APIRouter
+
+LONG_POLL_TIMEOUT = 30  # seconds a /ready request is held open before the client asks again
+
+
+class RoundCoordinator:
+    """Barrier that keeps the clients' download rounds in step.
+
+    Each client acks once its download finished and then long-polls /ready,
+    which answers as soon as the seeder has logged the round and started the
+    next one. Both endpoints are async, so waiting clients hold no worker
+    thread: they wait on an event per round that the seeder's main loop sets
+    on the API's event loop. The round state itself is guarded by a lock.
+    """
+
+    def __init__(self, expected_peers=3):
+        self.expected_peers = expected_peers
+        self.lock = threading.Lock()
+        self.round = 0
+        self.finished = {}  # client -> wall clock start and end of its download in this round
+        self.round_started = asyncio.Event()  # set once the round after the current one starts
+        self.loop = None  # the API's event loop, captured by the first request
+        self.router = APIRouter()
+        self.router.add_api_route("/ack", self.ack, methods=["POST"])
+        self.router.add_api_route("/ready", self.ready, methods=["GET"])
+
+    async def ack(self, data: dict):
+        with self.lock:
+            self.loop = asyncio.get_running_loop()
+            self.finished[data['client']] = {"start": data.get('start'), "finish": data['time']}
+            current_round = self.round
+        print(f"Client {data['client']} finished.")
+        return {"acknowledged": True, "round": current_round}
+
+    async def ready(self, client: str, timeout: float = LONG_POLL_TIMEOUT):
+        with self.lock:
+            self.loop = asyncio.get_running_loop()
+            round_started = self.round_started
+            waiting = client in self.finished
+        if waiting:
+            try:
+                await asyncio.wait_for(round_started.wait(), min(timeout, LONG_POLL_TIMEOUT))
+            except asyncio.TimeoutError:
+                pass
+        with self.lock:
+            return {"ready": client not in self.finished, "round": self.round}
+
+    def round_end_time(self):
+        """End time of the current round once every expected client finished it, else None."""
+        with self.lock:
+            if len(self.finished) < self.expected_peers:
+                return None
+            return max(times["finish"] for times in self.finished.values())
+
+    def finished_clients(self):
+        """Client -> start and end time of its download, for the clients that finished the current round."""
+        with self.lock:
+            return dict(self.finished)
+
+    def next_round(self):
+        with self.lock:
+            self.round += 1
+            self.finished = {}
+            round_started, self.round_started = self.round_started, asyncio.Event()
+            loop = self.loop
+        # called from the seeder's main thread, so wake the waiting clients on the API's loop
+        if loop is not None:
+            loop.call_soon_threadsafe(round_started.set)
@@ -2,80 +2,83 @@ import os
 import sys
 import time
 import json
+import socket
 import threading
 from datetime import datetime
 import statistics
 
+import click
 import libtorrent as lt
 import uvicorn
 from fastapi import FastAPI
-from rich import inspect
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir)
 
-from utils import Statistics, ExperimentConfig, ResultsManager, ProgressDisplay
+from utils import Statistics, ExperimentConfig, ResultsManager, ResultsLog
+from tracker import Tracker
+from coordinator import RoundCoordinator
+from settings import session_settings, peer_id
 
-FINISHED_CLIENTS = []
-LOGGED = False
-MX_TIME = 0.0
+ALERT_WAIT_MS = 100  # also how often the coordinator is asked whether the round is over
 
 app = FastAPI()
-router = FastAPI().router
-
-@router.post("/ack")
-def ack(data: dict):
-    global FINISHED_CLIENTS
-    global MX_TIME
-    print(f"Client {data['client']} finished.")
-    FINISHED_CLIENTS.append(data['client'])
-    MX_TIME = max(MX_TIME, data['time'])
-    return {"acknowledged": True}
-
-@router.get("/ready")
-def ready(client: str):
-    global LOGGED
-    global FINISHED_CLIENTS
-    global MX_TIME
-    if len(FINISHED_CLIENTS) == 3 and LOGGED:
-        FINISHED_CLIENTS = []
-        LOGGED = False
-        MX_TIME = 0.0
-    return {"ready": client not in FINISHED_CLIENTS}
-
-app.include_router(router)
-
-def run_api():
-    uvicorn.run(app, host="0.0.0.0", port=8001, reload=False, workers=1)
-
-def main():
-    global FINISHED_CLIENTS
-    global LOGGED
-    
-    api_thread = threading.Thread(target=run_api)
+tracker = Tracker()
+coordinator = RoundCoordinator()
+
+app.include_router(coordinator.router)
+app.include_router(tracker.router)
+
+def start_api(port=8001):
+    """Serve the API and the tracker on a background thread, and return once they accept connections."""
+    server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=port, reload=False, workers=1))
+    # daemon, so the process can exit once the results are saved on Ctrl+C
+    api_thread = threading.Thread(target=server.run, daemon=True)
     api_thread.start()
+    # the torrent's first announce would fail, and back off, if the tracker was not up yet
+    while not server.started:
+        if not api_thread.is_alive():
+            raise click.ClickException(f"The API could not start on port {port}")
+        time.sleep(0.05)
+
+@click.command()
+@click.argument('file_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--api-port', type=int, default=8001, show_default=True,
+              help='Port of the ack/ready API the clients report to')
+@click.option('--listen-port', type=int, default=6882, show_default=True,
+              help='Port the BitTorrent session listens on')
+@click.option('--peer-address', default=None,
+              help='Address clients can reach this seeder on; added to the magnet link as a direct peer')
+@click.option('--tracker-url', default=None,
+              help='Tracker put in the magnet link (default: the built-in tracker on the API port)')
+@click.option('--expected-peers', type=click.IntRange(min=1), default=3, show_default=True,
+              help='Number of clients that must finish before a round ends')
+@click.option('--name', default="vm1", show_default=True,
+              help='Machine name recorded as the server in the results file')
+@click.option('--output-dir', type=click.Path(file_okay=False), default=current_dir,
+              help='Directory the results file is written to (default: next to the seeder)')
+def main(file_path, api_port, listen_port, peer_address, tracker_url, expected_peers, name, output_dir):
+    coordinator.expected_peers = expected_peers
     
-    if os.path.exists("seeder_metrics.json"):
-        os.remove("seeder_metrics.json")
-        
-    if len(sys.argv) != 2:
-        print("Usage: python seeder.py <file_path>")
-        sys.exit(1)
-
-    file_path = os.path.abspath(sys.argv[1])
-    if not os.path.isfile(file_path):
-        print("Error: Provided file does not exist.")
-        sys.exit(1)
+    start_api(api_port)
     
+    file_path = os.path.abspath(file_path)
     file_size = os.path.getsize(file_path)
-    ses = lt.session({'listen_interfaces': '0.0.0.0:6882'})
+    ses = lt.session(session_settings(listen_port, lt.alert.category_t.error_notification |
+                                      lt.alert.category_t.status_notification |
+                                      lt.alert.category_t.connect_notification |
+                                      lt.alert.category_t.peer_notification))
 
     fs = lt.file_storage()
     lt.add_files(fs, file_path)
 
     torrent_creator = lt.create_torrent(fs)
-    tracker_url = "udp://tracker.openbittorrent.com:80"
+    if tracker_url is None:
+        # announce to our own tracker, at the address the clients reach this machine on
+        machine_config = ExperimentConfig.load_machine_config() or {}
+        host = peer_address or machine_config.get(name) or socket.gethostbyname(socket.gethostname())
+        tracker_url = f"http://{host}:{api_port}/announce"
     torrent_creator.add_tracker(tracker_url)
 
     print(f"Calculating piece hashes for {os.path.basename(file_path)}... (this may take a while)")
@@ -87,18 +90,19 @@ def main():
     info_hash = str(ti.info_hash())
     filename = os.path.basename(file_path)
     magnet_link = f"magnet:?xt=urn:btih:{info_hash}&dn={filename}&tr={tracker_url}"
+    if peer_address:
+        magnet_link += f"&x.pe={peer_address}:{listen_port}"
     print("Magnet link:")
     print(magnet_link)
 
-    metrics_log = []
-    transfer_start_time = None
-    active_peers = {}
+    active_peers = {}  # peer id -> time its connection was made
+    connect_times = {}  # endpoint -> time the last connection on it was made
     
     def add_new_torrent():
-        nonlocal start_time, transfer_start_time, active_peers
+        nonlocal start_time, active_peers, connect_times
         active_peers = {}
+        connect_times = {}
         start_time = time.time()
-        transfer_start_time = None
         return ses.add_torrent({
             'ti': ti,
             'save_path': os.path.dirname(file_path),
@@ -106,68 +110,72 @@ def main():
         })
 
     h = add_new_torrent()
-    log_file = str(time.strftime("%Y%m%d-%H%M%S"))+"_seeder_metrics.json"
+    log_file = str(time.strftime("%Y%m%d-%H%M%S"))+"_seeder_metrics.jsonl"
+    # one line per round, fsynced straight away so a crash loses at most the current round
+    metrics_log = ResultsLog(log_file, fsync_every=1)
 
     print(f"Seeding {filename}. Press Ctrl+C to stop.")
     start_time = time.time()
 
     try:
         while True:
-            s = h.status()
-            print("finished clients", FINISHED_CLIENTS)
-
-            print(f"\rSeeding {ti.name()}: up: {s.upload_rate / 1000:.1f} kB/s, "
-                  f"peers: {s.num_peers}, "
-                  f"total uploaded: {s.total_payload_upload / 1024:.1f} kB", end='')
+            # peer events are stamped as soon as libtorrent posts them
+            ses.wait_for_alert(ALERT_WAIT_MS)
+            for alert in ses.pop_alerts():
+                if not isinstance(alert, lt.peer_alert) or alert.handle != h:
+                    continue
+                current_time = time.time()
+                peer_ip, peer_port = alert.ip
+                endpoint = f"{peer_ip}:{peer_port}"
+
+                if isinstance(alert, lt.peer_connect_alert):
+                    # a connection to a client that has not added the torrent yet is dropped,
+                    # so only the latest connection on an endpoint counts
+                    connect_times[endpoint] = current_time
+                    print(f"Peer {endpoint} connected.")
+                # the peer id is known once the handshake is done; two peers may connect to
+                # each other at once, and only one of the two connections is kept
+                elif not alert.pid.is_all_zeros():
+                    active_peers.setdefault(str(alert.pid), connect_times.get(endpoint, current_time))
             sys.stdout.flush()
 
-            peers = h.get_peer_info()
-            inspect(peers)
-            print("peers", peers)
-            print("peers len", len(peers))
-            current_time = time.time()
-            if len(peers) > 0:
-                print("Entered peers")
-                sys.stdout.flush()
-                
-                if transfer_start_time is None:
-                    transfer_start_time = current_time
-
-                for peer in peers:
-                    peer_ip, peer_port = peer.ip  
-                    peer_id = f"{peer_ip}:{peer_port}"
-
-                    if peer_id not in active_peers:
-                        active_peers[peer_id] = {
-                            "start": current_time,
-                            "completed": False,
-                            "finish": None,
-                        }
-
-                    if not active_peers[peer_id]["completed"] and peer.progress >= 0.99:
-                        active_peers[peer_id]["completed"] = True
-                        active_peers[peer_id]["finish"] = current_time
-                        elapsed = current_time - active_peers[peer_id]["start"]
-                        print(f"\nPeer {peer_id} completed transfer in {elapsed:.2f} seconds.")
-                        sys.stdout.flush()
-
-            else:
-                print("\nNo peers connected yet.")
-
-            if len(FINISHED_CLIENTS) == 3 and not LOGGED:
-                end_time = MX_TIME
-                effective_start = transfer_start_time if transfer_start_time is not None else start_time
-                total_seeding_time = end_time - effective_start
+            end_time = coordinator.round_end_time()
+            if end_time is not None:
+                s = h.status()
+
+                # peers that are still connected may not have posted an alert with their id yet
+                for info in h.get_peer_info():
+                    if not info.pid.is_all_zeros():
+                        peer_ip, peer_port = info.ip
+                        active_peers.setdefault(str(info.pid), connect_times.get(f"{peer_ip}:{peer_port}", end_time))
 
+                # a peer completed when its client acked; peers that never ack, such as helper
+                # seeders, are listed by their peer id
+                finished_clients = coordinator.finished_clients()
+                clients = {peer_id(client).encode().hex(): client for client in finished_clients}
                 peer_details = {}
-                for pid, details in active_peers.items():
-                    transfer_time = (details["finish"] - details["start"]) if details["completed"] else None
-                    peer_details[pid] = {
-                        "start_time": details["start"],
-                        "finish_time": details["finish"],
-                        "transfer_time": transfer_time,
-                        "completed": details["completed"]
+                for pid, start in active_peers.items():
+                    peer_details[clients.get(pid, pid)] = {
+                        "start_time": start,
+                        "finish_time": None,
+                        "transfer_time": None,
+                        "completed": False
                     }
+                for client, times in finished_clients.items():
+                    # a client that got the whole file from other peers may connect here only
+                    # once it is done, so its own start time is used when it reported one
+                    details = peer_details.setdefault(client, {"start_time": None})
+                    if times["start"] is not None:
+                        details["start_time"] = times["start"]
+                    details.update(finish_time=times["finish"], completed=True, transfer_time=None)
+                    if details["start_time"] is not None:
+                        details["transfer_time"] = times["finish"] - details["start_time"]
+
+                # the round runs from the first client starting its transfer to the last ack;
+                # helper seeders and the idle time before the clients start do not count
+                client_starts = [details["start_time"] for details in peer_details.values()
+                                 if details["completed"] and details["start_time"] is not None]
+                total_seeding_time = end_time - (min(client_starts) if client_starts else start_time)
 
                 summary_log = {
                     "transfer_time": total_seeding_time,
@@ -175,7 +183,8 @@ def main():
                     "file_size": file_size,
                     "info_hash": info_hash,
                     "total_app_data": s.total_payload_upload,
-                    "overhead_ratio": s.total_upload / s.total_payload_upload,
+                    # with helper seeders in the swarm this seeder may upload nothing in a round
+                    "overhead_ratio": s.total_upload / s.total_payload_upload if s.total_payload_upload > 0 else 0,
                     "header_size": s.total_upload - s.total_payload_upload,
                     "run_payload_uploaded": s.total_payload_upload,
                     "total_seeding_time_seconds": total_seeding_time,
@@ -187,34 +196,21 @@ def main():
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 }
 
-                existing_logs = []
-                if os.path.exists(log_file):
-                    try:
-                        with open(log_file, 'r') as f:
-                            existing_logs = json.load(f)
-                    except json.JSONDecodeError:
-                        print(f"Warning: Could not parse existing {log_file}, creating new log")
-                combined_logs = existing_logs + [summary_log]
-                with open(log_file, 'w') as f:
-                    json.dump(combined_logs, f, indent=2)
+                metrics_log.append(summary_log)
 
-                print(f"\nThreshold reached. Logged transfer details to {log_file}. Restarting seeding...")
+                print(f"Round done: uploaded {s.total_payload_upload / 1024:.1f} kB to {len(active_peers)} peers "
+                      f"in {total_seeding_time:.6f}s. Logged transfer details to {log_file}. Restarting seeding...")
 
                 ses.remove_torrent(h)
                 h = add_new_torrent()
-                LOGGED = True
-
-            time.sleep(1)
+                # releases the clients waiting on /ready
+                coordinator.next_round()
 
     except KeyboardInterrupt:
         print("\nShutting down seeder.")
 
-        try:
-            with open(log_file, 'r') as f:
-                all_logs = json.load(f)
-        except Exception as e:
-            print("Error reading seeder_metrics.json:", e)
-            sys.exit(1)
+        metrics_log.close()
+        all_logs = ResultsLog.read(log_file)
 
         throughput_list = [run["throughput"] for run in all_logs if run.get("throughput", 0) > 0]
         if throughput_list:
@@ -244,11 +240,12 @@ def main():
         summ = Statistics.process_experiment_results(all_logs, str(file_size))
         print(summ)
         results_data = ResultsManager.initialize_results(
-            "p2p BitTorrent", "vm1", "A"
+            "p2p BitTorrent", name, "A"
         )
         if summ:
             results_data["files"][str(file_size)] = summ
-            ResultsManager.save_results(results_data, "bitTorrent", str(file_size), "vm1", current_dir)
+            os.makedirs(output_dir, exist_ok=True)
+            ResultsManager.save_results(results_data, "bitTorrent", str(file_size), name, output_dir)
         print("Seeder shutdown complete")
         sys.exit(0)
 
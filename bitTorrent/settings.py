@@ -0,0 +1,33 @@
+import hashlib
+
+import libtorrent as lt
+
+PEER_ID_PREFIX = "-EX0001-"
+
+
+def peer_id(name):
+    """20-character BitTorrent peer id of a named client, so the seeder can tell which connection is whose."""
+    return PEER_ID_PREFIX + hashlib.sha1(name.encode()).hexdigest()[:20 - len(PEER_ID_PREFIX)]
+
+
+def session_settings(listen_port, alert_mask, name=None):
+    """libtorrent settings shared by every peer of an experiment.
+
+    Peers find each other only through the tracker and the magnet link, so
+    DHT, local service discovery and port mapping stay off: they would add
+    traffic and peers from outside the experiment.
+    """
+    settings = {
+        'listen_interfaces': f'0.0.0.0:{listen_port}',
+        # peers of a local swarm all share one IP address
+        'allow_multiple_connections_per_ip': True,
+        'enable_dht': False,
+        'enable_lsd': False,
+        'enable_upnp': False,
+        'enable_natpmp': False,
+        'alert_mask': int(alert_mask),
+    }
+    if name is not None:
+        # a fingerprint of 20 characters is used as the whole peer id
+        settings['peer_fingerprint'] = peer_id(name)
+    return settings
@@ -0,0 +1,175 @@
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import subprocess
+import multiprocessing
+
+import click
+import libtorrent as lt
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+sys.path.insert(0, parent_dir)
+from utils import Statistics, ResultsLog, Processes
+from settings import session_settings
+
+# per-run result fields summarised for every peer
+PEER_METRICS = ["RTT", "MetadataTime", "AnnounceTime", "Throughput", "OverheadFileRatio"]
+
+def seed(magnet_link, save_path, listen_port, ready):
+    """Seed the file already in save_path until terminated; sets ready once seeding."""
+    ses = lt.session(session_settings(listen_port, lt.alert.category_t.status_notification))
+    params = lt.parse_magnet_uri(magnet_link)
+    params.save_path = save_path
+    handle = ses.add_torrent(params)
+    # once the metadata arrives the existing file is checked, and the torrent finishes straight away
+    while not ready.is_set():
+        ses.wait_for_alert(1000)
+        for alert in ses.pop_alerts():
+            if isinstance(alert, lt.torrent_finished_alert) and alert.handle == handle:
+                ready.set()
+    while True:
+        time.sleep(60)
+
+def start_helper_seeders(count, file_path, magnet_link, log_dir):
+    """Start count seeding processes, each with its own port and its own copy of the file."""
+    helpers = []
+    for i in range(count):
+        save_path = os.path.join(log_dir, f"seed{i}")
+        os.makedirs(save_path, exist_ok=True)
+        target = os.path.join(save_path, os.path.basename(file_path))
+        if not os.path.exists(target):
+            try:
+                os.link(file_path, target)
+            except OSError:
+                shutil.copyfile(file_path, target)
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(target=seed, args=(magnet_link, save_path, Processes.free_port(), ready), daemon=True)
+        process.start()
+        helpers.append((process, ready))
+
+    for process, ready in helpers:
+        if not ready.wait(Processes.STARTUP_TIMEOUT):
+            raise click.ClickException(f"A helper seeder was not seeding after {Processes.STARTUP_TIMEOUT}s")
+    return [process for process, _ in helpers]
+
+def peer_summary(results):
+    summary = {"runs": len(results)}
+    for metric in PEER_METRICS:
+        values = [result[metric] for result in results if result.get(metric) is not None]
+        if values:
+            summary[metric] = {**Statistics.calculate_statistics(values), **Statistics.robust_statistics(values)}
+    return summary
+
+def swarm_summary(file_path, leechers, seeders, peer_logs, seeder_dir):
+    """Per-peer statistics from the clients' logs, and per-round swarm totals from the seeder's log."""
+    file_size = os.path.getsize(file_path)
+    peers = {peer: peer_summary(ResultsLog.read(path)) for peer, path in peer_logs.items()}
+
+    rounds = []
+    seeder_logs = sorted(glob.glob(os.path.join(seeder_dir, "*_seeder_metrics.jsonl")))
+    for run in ResultsLog.read(seeder_logs[-1]) if seeder_logs else []:
+        # the round's leechers are the peers that acked; it lasts from the first one
+        # connecting to the last one finishing
+        finished = [details for details in run["peer_details"].values() if details["completed"]]
+        starts = [details["start_time"] for details in finished if details["start_time"] is not None]
+        round_time = max(details["finish_time"] for details in finished) - min(starts) if starts else 0
+        rounds.append({
+            "transfer_time": round_time,
+            "swarm_throughput": len(finished) * file_size * 0.008 / round_time if round_time > 0 else 0,
+            "seeder_uploaded": run["total_payload_uploaded"],
+        })
+
+    all_results = [result for path in peer_logs.values() for result in ResultsLog.read(path)]
+    return {
+        "file_name": os.path.basename(file_path),
+        "file_size_bytes": file_size,
+        "leechers": leechers,
+        "seeders": seeders,
+        "swarm": peer_summary(all_results),
+        "rounds": rounds,
+        "peers": peers,
+    }
+
+@click.command()
+@click.argument('file_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--leechers', type=click.IntRange(min=1), default=3, show_default=True,
+              help='Number of downloading clients')
+@click.option('--seeders', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of seeders, including the one that coordinates the rounds')
+@click.option('--runs', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Rounds in which every leecher downloads the file')
+@click.option('--reuse-session', is_flag=True, default=False,
+              help='Leechers keep one libtorrent session for all their runs')
+@click.option('--output-dir', type=click.Path(file_okay=False), default="swarm_results", show_default=True,
+              help='Directory the results and logs are written to')
+def main(file_path, leechers, seeders, runs, reuse_session, output_dir):
+    """Run a BitTorrent swarm of local processes and collect the metrics of every peer."""
+    file_path = os.path.abspath(file_path)
+    file_name = os.path.basename(file_path)
+    output_dir = os.path.abspath(output_dir)
+    log_dir = os.path.join(output_dir, "logs", f"{file_name}_{leechers}x{seeders}")
+    seeder_dir = os.path.join(log_dir, "seeder")
+    os.makedirs(seeder_dir, exist_ok=True)
+    env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+
+    api_port, listen_port = Processes.free_port(), Processes.free_port()
+    seeder = [sys.executable, os.path.join(current_dir, "seeder.py"), file_path,
+              "--api-port", str(api_port), "--listen-port", str(listen_port), "--peer-address", "127.0.0.1",
+              "--expected-peers", str(leechers), "--name", "local", "--output-dir", output_dir]
+    seeder_log = os.path.join(log_dir, "seeder.log")
+
+    start = time.monotonic()
+    with Processes.running(seeder, seeder_log, env, cwd=seeder_dir) as process:
+        magnet_link = Processes.wait_for_line(seeder_log, "magnet:?", process)
+        Processes.wait_for_port(api_port, process)
+        helpers = start_helper_seeders(seeders - 1, file_path, magnet_link, log_dir)
+        click.echo(click.style(f"Swarm: {file_name}, {leechers} leechers x {runs} runs, {seeders} seeders",
+                               fg='cyan', bold=True))
+
+        clients, peer_logs = [], {}
+        try:
+            for i in range(leechers):
+                # each client deletes ./downloads between runs, so give each its own directory
+                client_id = f"peer{i}"
+                client_dir = os.path.join(log_dir, client_id)
+                os.makedirs(client_dir, exist_ok=True)
+                command = [sys.executable, os.path.join(current_dir, "client.py"), magnet_link, str(runs),
+                           "--seeder", f"http://127.0.0.1:{api_port}", "--listen-port", str(Processes.free_port()),
+                           "--client-id", client_id, "--output-dir", output_dir]
+                if reuse_session:
+                    command.append("--reuse-session")
+                log = open(os.path.join(log_dir, f"{client_id}.log"), 'w')
+                clients.append((subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT,
+                                                 env=env, cwd=client_dir), log))
+                peer_logs[client_id] = os.path.join(output_dir, f"results_{file_name}_{client_id}_bitTorrent_log.jsonl")
+
+            for client_process, log in clients:
+                client_process.wait()
+                log.close()
+        finally:
+            for helper in helpers:
+                helper.terminate()
+        if any(client_process.returncode != 0 for client_process, _ in clients):
+            raise click.ClickException(f"A BitTorrent client failed, see the peer logs in {log_dir}")
+
+    summary = swarm_summary(file_path, leechers, seeders, peer_logs, seeder_dir)
+    summary_path = os.path.join(output_dir, f"swarm_{file_name}_{leechers}x{seeders}.json")
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    rtt = summary["swarm"].get("RTT", {})
+    click.echo(f"Mean download time per peer:" + click.style(f" {rtt.get('mean', 0):.6f}s", fg="magenta") +
+               click.style(f" (median {rtt.get('median', 0):.6f}s)", fg='blue'))
+    if summary["rounds"]:
+        throughput = Statistics.calculate_statistics([r["swarm_throughput"] for r in summary["rounds"]])
+        click.echo(f"Swarm throughput per round:" + click.style(f" {throughput['mean']:.2f} Kbps", fg="magenta") +
+                   click.style(f" (±{throughput['stddev']:.2f})", fg='blue'))
+    click.echo(click.style(f"Swarm finished in {time.monotonic() - start:.1f}s. Summary saved to {summary_path}",
+                           fg='bright_green', bold=True))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import socket
+import struct
+import threading
+import time
+from urllib.parse import parse_qs
+
+import libtorrent as lt
+from fastapi import APIRouter, Request, Response
+
+ANNOUNCE_INTERVAL = 30  # seconds between the regular re-announces of a peer
+DEFAULT_NUMWANT = 50
+
+
+class Tracker:
+    """Minimal in-process HTTP tracker (BEP 3) that answers with compact peer lists.
+
+    Peers are kept in memory per info hash and forgotten when they announce
+    "stopped" or miss two announce intervals. Its router is served next to
+    the seeder's API, so local experiments need no external tracker.
+    """
+
+    def __init__(self, interval=ANNOUNCE_INTERVAL):
+        self.interval = interval
+        self.swarms = {}  # info_hash -> {(ip, port): {"left": bytes left, "seen": monotonic time}}
+        self.lock = threading.Lock()
+        self.router = APIRouter()
+        self.router.add_api_route("/announce", self.announce, methods=["GET"])
+
+    async def announce(self, request: Request):
+        # info_hash and peer_id are raw bytes, percent-encoded one by one, so decode
+        # the query as latin-1 to map every byte to exactly one character
+        query = parse_qs(request.scope["query_string"].decode('latin-1'), encoding='latin-1')
+        param = lambda name, default=None: query.get(name, [default])[0]
+
+        info_hash = param("info_hash")
+        port = param("port")
+        if info_hash is None or len(info_hash.encode('latin-1')) != 20 or not (port or "").isdigit():
+            return self.reply({"failure reason": b"info_hash and port are required"})
+
+        peer = (param("ip") or request.client.host, int(port))
+        left = int(param("left", "0") or 0)
+        # an explicit numwant=0 asks for no peers; only a missing or malformed one means the default
+        numwant = param("numwant", "")
+        numwant = int(numwant) if numwant.isdigit() else DEFAULT_NUMWANT
+        now = time.monotonic()
+
+        with self.lock:
+            swarm = self.swarms.setdefault(info_hash, {})
+            for address, state in list(swarm.items()):
+                if now - state["seen"] > 2 * self.interval:
+                    del swarm[address]
+            if param("event") == "stopped":
+                swarm.pop(peer, None)
+            else:
+                swarm[peer] = {"left": left, "seen": now}
+            others = [address for address in swarm if address != peer][:numwant]
+            complete = sum(1 for state in swarm.values() if state["left"] == 0)
+            incomplete = len(swarm) - complete
+
+        peers, peers6 = b"", b""
+        for ip, peer_port in others:
+            if ":" in ip:
+                peers6 += socket.inet_pton(socket.AF_INET6, ip) + struct.pack("!H", peer_port)
+            else:
+                peers += socket.inet_aton(ip) + struct.pack("!H", peer_port)
+        return self.reply({"interval": self.interval, "complete": complete, "incomplete": incomplete,
+                           "peers": peers, "peers6": peers6})
+
+    @staticmethod
+    def reply(body):
+        return Response(content=lt.bencode(body), media_type="text/plain")
@@ -0,0 +1,73 @@
+import os
+import sys
+import mmap
+import time
+import click
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, current_dir)
+from utils import ExperimentConfig
+
+FILES_DIR = os.path.join(current_dir, "files")
+BLOCK_SIZE = 4 * 1024 * 1024
+CONTENTS = ["random", "compressible", "sparse"]
+
+manifest = ExperimentConfig.load_file_manifest()
+
+def compressible_block(size):
+    line = b"The quick brown fox jumps over the lazy dog. 0123456789\n"
+    return (line * (size // len(line) + 1))[:size]
+
+def write_file(path, size, content, seed=None):
+    """Write size bytes of content to path, replacing it atomically."""
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, 'w+b') as f:
+            # sparse files are a single hole; the file system reads it back as zeros
+            f.truncate(size)
+            if content != "sparse" and size > 0:
+                rng = np.random.default_rng(seed)
+                pattern = compressible_block(BLOCK_SIZE) if content == "compressible" else None
+                with mmap.mmap(f.fileno(), size) as mm:
+                    for offset in range(0, size, BLOCK_SIZE):
+                        length = min(BLOCK_SIZE, size - offset)
+                        mm[offset:offset + length] = pattern[:length] if pattern else rng.bytes(length)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@click.command()
+@click.option('--size', 'sizes', type=click.Choice([size["label"] for size in manifest["sizes"]]), multiple=True,
+              help='Sizes to generate (repeatable, default: every non-optional size in the manifest)')
+@click.option('--prefix', 'prefixes', type=click.Choice(manifest["prefixes"]), multiple=True,
+              help='File prefixes to generate (repeatable, default: all)')
+@click.option('--content', type=click.Choice(CONTENTS), default='random', show_default=True,
+              help='Random bytes, highly compressible text, or a sparse file of zeros')
+@click.option('--seed', type=int, default=None,
+              help='Random seed for reproducible random content')
+@click.option('--force', is_flag=True, default=False,
+              help='Regenerate files that already exist with the right size')
+@click.option('--output-dir', type=click.Path(file_okay=False), default=FILES_DIR,
+              help='Directory to write the files to (default: files/)')
+def main(sizes, prefixes, content, seed, force, output_dir):
+    prefixes = prefixes or manifest["prefixes"]
+    selected = [size for size in manifest["sizes"]
+                if size["label"] in sizes or (not sizes and not size.get("optional", False))]
+    os.makedirs(output_dir, exist_ok=True)
+
+    for prefix in prefixes:
+        for size in selected:
+            path = os.path.join(output_dir, f"{prefix}_{size['label']}")
+            if not force and os.path.isfile(path) and os.path.getsize(path) == size["bytes"]:
+                click.echo(f"{path} is up to date")
+                continue
+            start = time.perf_counter()
+            write_file(path, size["bytes"], content, seed)
+            elapsed = time.perf_counter() - start
+            click.echo(click.style(f"Wrote {path} ({size['bytes']} bytes, {content}) in {elapsed:.2f}s", fg='green'))
+
+if __name__ == "__main__":
+    main()
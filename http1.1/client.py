@@ -1,88 +1,362 @@
 import requests
-import time
 import os
 import click
 import sys
-from requests_toolbelt.utils import dump
+import socket
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir)
-from utils import Statistics, ExperimentConfig, ResultsManager, ProgressDisplay
+from utils import Statistics, ExperimentConfig, ResultsManager, ProgressDisplay, ResponseSink, PhaseTimer, ExperimentAccumulator, ResultsLog, ExperimentSpec
+
+CHUNK_SIZE = 64 * 1024
+
+# phase timer and connections opened by the current thread's request in flight
+connection_stats = threading.local()
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        super().connect()
+        connection_stats.connections_opened += 1
+        connection_stats.timer.mark("connect")
+
+    def request(self, *args, **kwargs):
+        super().request(*args, **kwargs)
+        connection_stats.timer.mark("request_sent")
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        connection_stats.timer.mark("first_byte")
+        return response
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme,
+            "http": TimedHTTPConnectionPool
+        }
+
+
+class PipelinedConnection:
+    """A raw persistent connection that can have several requests outstanding.
+
+    requests/urllib3 cannot pipeline, so requests are written straight to the
+    socket and responses are parsed back in order.
+    """
+
+    def __init__(self, server_host, server_port, timeout=30):
+        self.host_header = f"{server_host}:{server_port}"
+        self.sock = socket.create_connection((server_host, server_port), timeout=timeout)
+        self.reader = self.sock.makefile('rb')
+
+    def send_request(self, file_name):
+        request = (f"GET /{file_name} HTTP/1.1\r\n"
+                   f"Host: {self.host_header}\r\n"
+                   "Accept: */*\r\n\r\n").encode()
+        self.sock.sendall(request)
+        return len(request)
+
+    def read_headers(self):
+        status_line = self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Server closed the connection (is it running with --keepalive?)")
+        header_size = len(status_line)
+        headers = {}
+        while True:
+            line = self.reader.readline()
+            header_size += len(line)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return int(status_line.split()[1]), headers, header_size
+
+    def read_body(self, content_length, sink):
+        remaining = content_length
+        while remaining:
+            chunk = self.reader.read(min(remaining, 65536))
+            if not chunk:
+                raise ConnectionError("Connection closed in the middle of a response")
+            sink.write(chunk)
+            remaining -= len(chunk)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
 
 class HTTP11Client:
-    def __init__(self, server_host, server_port=8000):
+    MODES = ["sequential", "parallel", "pipeline"]
+
+    def __init__(self, server_host, server_port=8000, reuse_connection=False, pool_size=1,
+                 mode="sequential", concurrency=1, sink="count", max_raw_samples=1000):
         self.server_host = server_host
         self.server_port = server_port
         self.server_url = f"http://{server_host}:{server_port}/"
         self.protocol_name = "HTTP/1.1"
+        self.reuse_connection = reuse_connection
+        self.mode = mode
+        self.concurrency = concurrency if mode != "sequential" else 1
+        # parallel downloads need a pooled connection per worker thread
+        self.pool_size = max(pool_size, self.concurrency)
+        self.sink = sink
+        self.max_raw_samples = max_raw_samples
+        self.results_log = None
+        self.session = self.create_session() if reuse_connection else None
+    
+    def create_sink(self, file_name, content_length):
+        if self.mode == "parallel":
+            # parallel workers must not write into the same download file
+            file_name = f"{file_name}.{threading.current_thread().name}"
+        return ResponseSink.create(self.sink, file_name, content_length)
+    
+    @staticmethod
+    def request_header_size(request):
+        request_line = f"{request.method} {request.path_url} HTTP/1.1\r\n"
+        return len(request_line) + sum(len(f"{k}: {v}\r\n") for k, v in request.headers.items()) + 2
+    
+    @staticmethod
+    def response_header_size(response):
+        status_line = f"HTTP/1.1 {response.status_code} {response.reason}\r\n"
+        return len(status_line) + sum(len(f"{k}: {v}\r\n") for k, v in response.raw.headers.items()) + 2
+    
+    def create_session(self):
+        session = requests.Session()
+        session.mount("http://", TimedHTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+        return session
+    
+    def close(self):
+        if self.session:
+            self.session.close()
+            self.session = None
     
     def download_file(self, file_name, timeout=30):
-        start_time = time.time()
+        connection_stats.connections_opened = 0
+        connection_stats.timer = timer = PhaseTimer()
         url = f"{self.server_url}{file_name}"
         
         try:
-            headers = {'Connection': 'close'}
-            response = requests.get(url, stream=False, timeout=timeout, headers=headers)
-            response.raise_for_status()
+            if self.reuse_connection:
+                session, headers = self.session, {}
+            else:
+                # a fresh session per request, just like the module-level requests.get()
+                session, headers = self.create_session(), {'Connection': 'close'}
             
-            end_time = time.time()
-            transfer_time = end_time - start_time
-
-            data = dump.dump_response(response)
-            total_app_data = len(data)
+            try:
+                with session.get(url, stream=True, timeout=timeout, headers=headers) as response:
+                    response.raise_for_status()
+                    
+                    # the body is streamed into the sink, so only the headers are ever held in memory
+                    sink = self.create_sink(file_name, int(response.headers.get("Content-Length", 0)))
+                    try:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            sink.write(chunk)
+                    finally:
+                        sink.close()
+                    timer.mark("body_complete")
+            finally:
+                if not self.reuse_connection:
+                    session.close()
+            timer.mark("teardown")
 
-            file_size = int(response.headers.get("Content-Length", 0))
-            throughput = file_size * 8 / transfer_time if transfer_time > 0 else 0
+            file_size = sink.bytes_received
+            total_app_data = (self.request_header_size(response.request) +
+                              self.response_header_size(response) + file_size)
             
-            header_size = total_app_data - file_size
-            overhead_ratio = total_app_data / file_size if file_size > 0 else 0
-            
-            return {
-                'transfer_time': transfer_time,
-                'throughput': throughput,
-                'file_size': file_size,
-                'total_app_data': total_app_data,
-                'overhead_ratio': overhead_ratio,
-                'header_size': header_size
-            }
+            result = self.build_result(file_size, total_app_data, timer,
+                                       connection_stats.connections_opened == 0)
+            if self.sink == "hash":
+                result['sha256'] = sink.hexdigest
+            return result
         
         except Exception as e:
             click.echo(click.style(f"\n❌ Error downloading {url}: {str(e)}", 
                                    fg='bright_red', bold=True))
             return None
 
-    def run_experiment(self, file_name, repetitions):
-        results = []
+    @staticmethod
+    def build_result(file_size, total_app_data, timer, connection_reused):
+        phases = timer.phases()
+        transfer_time = timer.elapsed("body_complete")
+        throughput = file_size * 8 / transfer_time if transfer_time > 0 else 0
+        
+        header_size = total_app_data - file_size
+        overhead_ratio = total_app_data / file_size if file_size > 0 else 0
+        
+        return {
+            'transfer_time': transfer_time,
+            'throughput': throughput,
+            'file_size': file_size,
+            'total_app_data': total_app_data,
+            'overhead_ratio': overhead_ratio,
+            'header_size': header_size,
+            'connect_time': phases['connect'],
+            'latency': phases['request_sent'] + phases['first_byte'],
+            'connection_reused': connection_reused,
+            'phases': phases
+        }
+
+    def download_parallel(self, file_name, repetitions, bar, record, stop=lambda: False):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = set()
+            issued = 0
+            while pending or (issued < repetitions and not stop()):
+                while issued < repetitions and len(pending) < self.concurrency and not stop():
+                    pending.add(executor.submit(self.download_file, file_name))
+                    issued += 1
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if result:
+                        record(result)
+                    bar.update(1)
+
+    def download_pipelined(self, file_name, repetitions, bar, record, stop=lambda: False):
+        """Keep up to concurrency requests outstanding on one persistent connection.
+
+        Each response is timed from the moment its request was written, so
+        head-of-line blocking behind earlier responses is part of its time.
+        """
+        connection = None
+        last = None  # the last response is recorded once the connection teardown is timed
+        timer = PhaseTimer()
+        try:
+            connection = PipelinedConnection(self.server_host, self.server_port)
+            timer.mark("connect")
+            pending = deque()
+            issued = 0
+            
+            while pending or (issued < repetitions and not stop()):
+                while issued < repetitions and len(pending) < self.concurrency and not stop():
+                    if issued > 0:
+                        timer = PhaseTimer()
+                    request_size = connection.send_request(file_name)
+                    timer.mark("request_sent")
+                    pending.append((timer, request_size))
+                    issued += 1
+                
+                timer, request_size = pending.popleft()
+                status, headers, header_size = connection.read_headers()
+                timer.mark("first_byte")
+                if status != 200:
+                    raise ConnectionError(f"Server answered {status}")
+                
+                file_size = int(headers.get('content-length', 0))
+                sink = self.create_sink(file_name, file_size)
+                try:
+                    connection.read_body(file_size, sink)
+                finally:
+                    sink.close()
+                timer.mark("body_complete")
+                
+                result = self.build_result(file_size, request_size + header_size + file_size,
+                                           timer, "connect" not in timer.marks)
+                if self.sink == "hash":
+                    result['sha256'] = sink.hexdigest
+                if last:
+                    record(last[0])
+                last = (result, timer)
+                bar.update(1)
         
-        with ProgressDisplay.create_progress_bar(file_name, repetitions) as bar:
+        except Exception as e:
+            click.echo(click.style(f"\n❌ Error downloading {self.server_url}{file_name}: {str(e)}", 
+                                   fg='bright_red', bold=True))
+        finally:
+            if connection:
+                connection.close()
+            if last:
+                # closing the connection is the teardown of the last response
+                result, timer = last
+                timer.mark("teardown")
+                result['phases'] = timer.phases()
+                record(result)
+
+    def download(self, file_name, repetitions, bar, record, stop=lambda: False):
+        if self.mode == "parallel":
+            self.download_parallel(file_name, repetitions, bar, record, stop)
+        elif self.mode == "pipeline":
+            self.download_pipelined(file_name, repetitions, bar, record, stop)
+        else:
             for i in bar:
+                if stop():
+                    break
                 result = self.download_file(file_name)
                 if result:
-                    results.append(result)
+                    record(result)
+
+    def run_experiment(self, file_name, repetitions, completed=None, warmup=0, stopping_rule=None):
+        accumulator = ExperimentAccumulator(file_name, self.max_raw_samples)
+        for result in completed or []:
+            accumulator.add(result)
+        remaining = repetitions - accumulator.count
+        
+        def record(result):
+            accumulator.add(result)
+            if self.results_log:
+                self.results_log.append({"file_name": file_name, **result})
         
-        if not results:
+        if remaining > 0 and warmup > 0:
+            with ProgressDisplay.create_progress_bar(f"{file_name} (warmup)", warmup) as bar:
+                self.download(file_name, warmup, bar, lambda result: None)
+        
+        if remaining > 0:
+            stop = lambda: False
+            if stopping_rule:
+                stopping_rule.start()
+                stop = lambda: stopping_rule.reached(accumulator)
+            with ProgressDisplay.create_progress_bar(file_name, remaining) as bar:
+                self.download(file_name, remaining, bar, record, stop)
+            if stopping_rule and stopping_rule.reason:
+                click.echo(click.style(f"Stopped after {accumulator.count} repetitions: {stopping_rule.reason}",
+                                       fg='yellow'))
+        
+        if accumulator.count == 0:
             click.echo(click.style(f"❌ All download attempts failed for {file_name}", 
                                   fg='bright_red', bold=True))
             return None
         
-        summary = Statistics.process_experiment_results(results, file_name)
+        summary = accumulator.summary()
         Statistics.print_experiment_summary(file_name, summary)
         return summary
 
-    def run_experiments(self, server, file_prefix, experiments=None):
+    def run_experiments(self, server, file_prefix, experiments=None, output_dir=None, resume=False,
+                        stopping_rule=None):
         if experiments is None:
             experiments = ExperimentConfig.get_default_experiments()
         
         results_data = ResultsManager.initialize_results(
-            self.protocol_name, server, file_prefix
+            self.protocol_name, server, file_prefix, self.concurrency
         )
+        results_data["mode"] = self.mode
         
-        for exp in experiments:
-            file_name = f"{file_prefix}_{exp['size']}"
-            results = self.run_experiment(file_name, exp['repetitions'])
-            if results:
-                results_data["files"][file_name] = results
+        log_path = ResultsManager.log_filepath(ResultsManager.results_filepath(
+            results_data, self.protocol_name, file_prefix, server, output_dir
+        ))
+        completed = ResultsLog.completed_by_file(log_path) if resume else {}
+        self.results_log = ResultsLog(log_path, resume=resume)
+        
+        try:
+            for exp in experiments:
+                file_name = f"{file_prefix}_{exp['size']}"
+                results = self.run_experiment(file_name, exp['repetitions'], completed.get(file_name),
+                                              exp.get('warmup', 0), stopping_rule)
+                if results:
+                    results_data["files"][file_name] = results
+        finally:
+            self.close()
+            self.results_log.close()
         
         return results_data
 
@@ -92,12 +366,52 @@ machine_config = ExperimentConfig.load_machine_config()
 @click.command()
 @click.option('--server', type=click.Choice(list(machine_config)), required=True, 
               help='Server to connect to')
-@click.option('--file', type=click.Choice(['A', 'B']), required=True,
+@click.option('--file', type=click.Choice(ExperimentConfig.get_file_prefixes()), required=True,
               help='File prefix to request (A or B)')
-def main(server, file):
+@click.option('--reuse-connection/--no-reuse-connection', default=False, show_default=True,
+              help='Keep connections open between requests (start the server with --keepalive)')
+@click.option('--pool-size', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Maximum number of persistent connections kept in the pool')
+@click.option('--mode', type=click.Choice(HTTP11Client.MODES), default='sequential', show_default=True,
+              help='Download one file at a time, over parallel connections, or pipelined on one connection')
+@click.option('--concurrency', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Parallel connections (parallel) or outstanding requests (pipeline)')
+@click.option('--sink', type=click.Choice(ResponseSink.KINDS), default='count', show_default=True,
+              help='What to do with response bodies: count bytes, keep them in memory, '
+                   'write them to downloads/, or SHA-256 hash them while streaming')
+@click.option('--max-raw-samples', type=click.IntRange(min=0), default=1000, show_default=True,
+              help='Raw per-request results kept per file (a uniform random sample beyond this)')
+@click.option('--resume', is_flag=True, default=False,
+              help='Continue an interrupted run from its results log instead of starting over')
+@click.option('--port', type=int, default=8000, show_default=True,
+              help='Server port')
+@click.option('--scale', type=click.FloatRange(min=0, min_open=True), default=1.0, show_default=True,
+              help='Multiply the number of repetitions of every file size (at least 1 each)')
+@click.option('--output-dir', type=click.Path(file_okay=False), default=current_dir,
+              help='Directory the results files are written to (default: next to the client)')
+@click.option('--size', 'sizes', type=click.Choice(list(ExperimentConfig.get_size_labels().values())), multiple=True,
+              help='File sizes to download (repeatable, default: every non-optional size in files/manifest.json)')
+@click.option('--spec', 'spec_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Experiment spec file: sizes, repetitions, warmup, concurrency levels, time budget '
+                   'and adaptive stopping (see specs/default.json)')
+@click.option('--warmup', type=click.IntRange(min=0), default=None,
+              help='Untimed downloads of each file before the measured ones (default: from --spec, else 0)')
+def main(server, file, reuse_connection, pool_size, mode, concurrency, sink, max_raw_samples, resume, port, scale,
+         output_dir, sizes, spec_path, warmup):
     server_ip = ExperimentConfig.get_server_ip(machine_config, server)
-    client = HTTP11Client(server_ip)
-    results_data = client.run_experiments(server, file)
-    ResultsManager.save_results(results_data, "HTTP/1.1", file, server, current_dir)
+    spec = ExperimentSpec.load(spec_path, "http1.1")
+    if warmup is not None:
+        spec.warmup = warmup
+    experiments = spec.experiments(scale, sizes)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # a spec can sweep concurrency levels; sequential mode always runs one request at a time
+    levels = spec.concurrency if spec.concurrency and mode != "sequential" else [concurrency]
+    for level in levels:
+        client = HTTP11Client(server_ip, port, reuse_connection=reuse_connection, pool_size=pool_size,
+                              mode=mode, concurrency=level, sink=sink, max_raw_samples=max_raw_samples)
+        results_data = client.run_experiments(server, file, experiments, output_dir=output_dir, resume=resume,
+                                              stopping_rule=spec.stopping_rule())
+        ResultsManager.save_results(results_data, "HTTP/1.1", file, server, output_dir)
 
 main()
\ No newline at end of file
@@ -1,27 +1,158 @@
 import http.server
 import socketserver
+import socket
 import os
+import signal
+import threading
+import click
+from concurrent.futures import ThreadPoolExecutor
 
 class CustomHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    disable_nagle_algorithm = True  # headers and a sendfile() body go out as separate writes
+
     def __init__(self, *args, **kwargs):
         file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "files")
         self.files_dir = os.path.abspath(file_path)
         super().__init__(*args, directory=self.files_dir, **kwargs)
-    
+
+    def setup(self):
+        if self.server.keepalive:
+            # HTTP/1.1 keeps the connection open until the client closes it or goes idle
+            self.protocol_version = "HTTP/1.1"
+            self.timeout = self.server.keepalive_timeout
+        super().setup()
+
     def end_headers(self):
-        self.send_header('Connection', 'close')  # make sure connection closes after each request
+        if not self.server.keepalive:
+            self.send_header('Connection', 'close')  # make sure connection closes after each request
         super().end_headers()
 
-def start_server(port=8000):
-    socketserver.TCPServer.allow_reuse_address = True
-    with socketserver.TCPServer(("0.0.0.0", port), CustomHTTPRequestHandler) as httpd:
-        print(f"Serving HTTP on 0.0.0.0 port {port} (http://0.0.0.0:{port}/)")
+    def copyfile(self, source, outputfile):
+        if not self.server.sendfile:
+            return super().copyfile(source, outputfile)
+        # headers are already on the wire (wfile is unbuffered), so let the kernel
+        # copy the body straight from the page cache into the socket
+        self.connection.sendfile(source)
+
+
+class FileServer(socketserver.TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, keepalive=False, keepalive_timeout=5.0, sendfile=True):
+        self.keepalive = keepalive
+        self.keepalive_timeout = keepalive_timeout
+        self.sendfile = sendfile
+        super().__init__(server_address, handler_class)
+
+
+class ThreadPoolFileServer(FileServer):
+    """Serves each accepted connection on a fixed pool of worker threads."""
+
+    def __init__(self, server_address, handler_class, workers, **kwargs):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.active_requests = set()
+        self.active_lock = threading.Lock()
+        super().__init__(server_address, handler_class, **kwargs)
+
+    def process_request(self, request, client_address):
+        with self.active_lock:
+            self.active_requests.add(request)
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
         try:
-            httpd.serve_forever()
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self.active_lock:
+                self.active_requests.discard(request)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # wake up workers parked on idle persistent connections
+        with self.active_lock:
+            for request in self.active_requests:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def serve_prefork(httpd, workers):
+    # children inherit the listening socket and compete in accept()
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                httpd.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    
+    # installed after forking, so the children keep the default SIGTERM action;
+    # a SIGTERM to the parent then stops the workers too instead of orphaning them
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+
+def start_server(port=8000, workers=1, model="thread", keepalive=False, keepalive_timeout=5.0, sendfile=True):
+    options = {"keepalive": keepalive, "keepalive_timeout": keepalive_timeout, "sendfile": sendfile}
+    if model == "thread" and workers > 1:
+        httpd = ThreadPoolFileServer(("0.0.0.0", port), CustomHTTPRequestHandler, workers, **options)
+    else:
+        httpd = FileServer(("0.0.0.0", port), CustomHTTPRequestHandler, **options)
+
+    with httpd:
+        print(f"Serving HTTP on 0.0.0.0 port {port} (http://0.0.0.0:{port}/) "
+              f"[{workers} {model} worker(s), keep-alive {'on' if keepalive else 'off'}]")
+        try:
+            if model == "prefork" and workers > 1:
+                serve_prefork(httpd, workers)
+            else:
+                httpd.serve_forever()
         except KeyboardInterrupt:
             pass
         finally:
             httpd.server_close()
             print("Server stopped.")
 
-start_server()
\ No newline at end of file
+
+@click.command()
+@click.option('--port', type=int, default=8000, show_default=True,
+              help='Port to listen on')
+@click.option('--workers', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of connections served concurrently (1 = one connection at a time)')
+@click.option('--model', type=click.Choice(['thread', 'prefork']), default='thread', show_default=True,
+              help='Worker model used when --workers is greater than 1')
+@click.option('--keepalive/--no-keepalive', default=False, show_default=True,
+              help='Keep connections open between requests (HTTP/1.1 persistent connections)')
+@click.option('--keepalive-timeout', type=float, default=5.0, show_default=True,
+              help='Seconds an idle persistent connection is kept open')
+@click.option('--sendfile/--no-sendfile', default=True, show_default=True,
+              help='Send file bodies with zero-copy sendfile() instead of copying through user space')
+def main(port, workers, model, keepalive, keepalive_timeout, sendfile):
+    start_server(port, workers, model, keepalive, keepalive_timeout, sendfile)
+
+main()
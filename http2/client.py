@@ -1,5 +1,4 @@
 import socket
-import time
 import os
 import sys
 import click
@@ -11,21 +10,31 @@ import h2.settings
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir)
-from utils import Statistics, ExperimentConfig, ResultsManager, ProgressDisplay
+from utils import Statistics, ExperimentConfig, ResultsManager, ProgressDisplay, ResponseSink, PhaseTimer, ExperimentAccumulator, ResultsLog, ExperimentSpec
+
+RECV_BUFFER_SIZE = 256 * 1024
 
 class HTTP2Client:
-    def __init__(self, server_host, server_port=8000):
+    def __init__(self, server_host, server_port=8000, concurrency=1, sink="count", max_raw_samples=1000):
         self.server_host = server_host
         self.server_port = server_port
+        self.concurrency = concurrency
+        self.sink = sink
+        self.max_raw_samples = max_raw_samples
+        self.results_log = None
         self.connection = None
         self.socket = None
         self.protocol_name = "HTTP/2"
+        self.recv_buffer = bytearray(RECV_BUFFER_SIZE)
+        self.recv_view = memoryview(self.recv_buffer)
 
     def open_connection(self):
         try:
             socket.setdefaulttimeout(15)
             
             self.socket = socket.create_connection((self.server_host, self.server_port))
+            # small HEADERS and WINDOW_UPDATE writes must not wait for delayed ACKs
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             
             self.connection = h2.connection.H2Connection()
             self.connection.local_settings = h2.settings.Settings(
@@ -59,116 +68,251 @@ class HTTP2Client:
             self.connection = None
             self.socket = None
 
+    def request_headers(self, file_name):
+        return [
+            (":method", "GET"),
+            (":scheme", "http"),
+            (":authority", f"{self.server_host}:{self.server_port}"),
+            (":path", f"/{file_name}"),
+            ("accept", "*/*"),
+        ]
+
+    def receive_events(self):
+        # reuse one buffer for every read instead of allocating a new bytes object
+        received = self.socket.recv_into(self.recv_buffer)
+        if not received:
+            return None
+        return self.connection.receive_data(self.recv_view[:received])
+
+    def create_sink(self, name, response_headers):
+        content_length = int(dict(response_headers).get(b'content-length', 0))
+        return ResponseSink.create(self.sink, name, content_length)
+
+    @staticmethod
+    def build_result(file_size, header_data_size, timer):
+        transfer_time = timer.elapsed("body_complete")
+        framing_overhead = 18
+        total_app_data = header_data_size + file_size + framing_overhead
+        overhead_ratio = total_app_data / file_size if file_size > 0 else 0
+        
+        throughput = (file_size * 8) / transfer_time if transfer_time > 0 else 0
+        
+        return {
+            'transfer_time': transfer_time,
+            'file_size': file_size,
+            'throughput': throughput,
+            'total_app_data': total_app_data,
+            'overhead_ratio': overhead_ratio,
+            'time_to_first_byte': timer.elapsed("first_byte"),
+            'phases': timer.phases()
+        }
+
     def download_file(self, file_name):
         if not self.connection or not self.socket:
             click.echo(click.style("Error: Connection not open", fg='bright_red'))
             return None
         
-        start_time = time.time()
+        timer = PhaseTimer()
         
         try:
-            headers = [
-                (":method", "GET"),
-                (":scheme", "http"),
-                (":authority", f"{self.server_host}:{self.server_port}"),
-                (":path", f"/{file_name}"),
-                ("accept", "*/*"),
-            ]
+            headers = self.request_headers(file_name)
             
             stream_id = self.connection.get_next_available_stream_id()
             self.connection.send_headers(stream_id, headers)
             self.socket.sendall(self.connection.data_to_send())
+            timer.mark("request_sent")
             
             response_ended = False
             header_data_size = 0
-            received_data = b""
+            sink = ResponseSink()
             
             while not response_ended:
-                data = self.socket.recv(65536 * 1024)
-                if not data:
+                events = self.receive_events()
+                if events is None:
                     break
                 
-                events = self.connection.receive_data(data)
                 for event in events:
                     if isinstance(event, h2.events.ResponseReceived):
+                        timer.mark("first_byte")
                         header_data_size = sum(len(name) + len(value) for name, value in event.headers)
+                        sink = self.create_sink(file_name, event.headers)
                     
                     if isinstance(event, h2.events.DataReceived):
-                        received_data += event.data
+                        sink.write(event.data)
                         
                         self.connection.acknowledge_received_data(
                             event.flow_controlled_length, event.stream_id
                         )
                     
                     if isinstance(event, h2.events.StreamEnded):
+                        timer.mark("body_complete")
                         response_ended = True
                         break
                 
                 self.socket.sendall(self.connection.data_to_send())
             
-            end_time = time.time()
-            transfer_time = end_time - start_time
-            
-            file_size = len(received_data)
-            
-            framing_overhead = 18
-            total_app_data = header_data_size + file_size + framing_overhead
-            overhead_ratio = total_app_data / file_size if file_size > 0 else 0
-            
-            throughput = (file_size * 8) / transfer_time if transfer_time > 0 else 0
+            sink.close()
+            timer.mark("teardown")
             
-            return {
-                'transfer_time': transfer_time,
-                'file_size': file_size,
-                'throughput': throughput,
-                'total_app_data': total_app_data,
-                'overhead_ratio': overhead_ratio
-            }
+            result = self.build_result(sink.bytes_received, header_data_size, timer)
+            if self.sink == "hash":
+                result['sha256'] = sink.hexdigest
+            return result
             
         except Exception as e:
             click.echo(click.style(f"\n❌ Error downloading {file_name}: {str(e)}", 
                                   fg='bright_red', bold=True))
             return None
 
-    def run_experiment(self, file_name, repetitions):
-        results = []
+    def download_concurrently(self, file_name, repetitions, concurrency, bar, record, stop=lambda: False):
+        """Download file_name repetitions times keeping up to concurrency streams in flight.
+
+        Events are demultiplexed by stream_id, and each stream is timed from
+        the moment its request is queued until its StreamEnded arrives.
+        """
+        if not self.connection or not self.socket:
+            click.echo(click.style("Error: Connection not open", fg='bright_red'))
+            return
         
-        with ProgressDisplay.create_progress_bar(file_name, repetitions) as bar:
+        streams = {}
+        issued = 0
+        # a stream writes to the download file of its concurrency slot, so --sink file
+        # leaves one file per slot behind rather than one per repetition
+        free_slots = list(range(concurrency))
+        
+        try:
+            while streams or (issued < repetitions and not stop()):
+                queued = []
+                while issued < repetitions and len(streams) < concurrency and not stop():
+                    stream_id = self.connection.get_next_available_stream_id()
+                    self.connection.send_headers(stream_id, self.request_headers(file_name), end_stream=True)
+                    streams[stream_id] = {
+                        'timer': PhaseTimer(),
+                        'header_data_size': 0,
+                        'sink': ResponseSink(),
+                        'slot': free_slots.pop()
+                    }
+                    queued.append(streams[stream_id]['timer'])
+                    issued += 1
+                self.socket.sendall(self.connection.data_to_send())
+                for timer in queued:
+                    timer.mark("request_sent")
+                
+                events = self.receive_events()
+                if events is None:
+                    break
+                
+                for event in events:
+                    if isinstance(event, h2.events.ResponseReceived):
+                        stream = streams[event.stream_id]
+                        stream['timer'].mark("first_byte")
+                        stream['header_data_size'] = sum(len(name) + len(value) for name, value in event.headers)
+                        stream['sink'] = self.create_sink(f"{file_name}.{stream['slot']}", event.headers)
+                    
+                    elif isinstance(event, h2.events.DataReceived):
+                        streams[event.stream_id]['sink'].write(event.data)
+                        self.connection.acknowledge_received_data(
+                            event.flow_controlled_length, event.stream_id
+                        )
+                    
+                    elif isinstance(event, h2.events.StreamEnded):
+                        stream = streams.pop(event.stream_id)
+                        stream['timer'].mark("body_complete")
+                        stream['sink'].close()
+                        free_slots.append(stream['slot'])
+                        result = self.build_result(stream['sink'].bytes_received, stream['header_data_size'],
+                                                   stream['timer'])
+                        result['stream_id'] = event.stream_id
+                        if self.sink == "hash":
+                            result['sha256'] = stream['sink'].hexdigest
+                        record(result)
+                        bar.update(1)
+                
+                self.socket.sendall(self.connection.data_to_send())
+        
+        except Exception as e:
+            click.echo(click.style(f"\n❌ Error downloading {file_name}: {str(e)}", 
+                                  fg='bright_red', bold=True))
+        finally:
+            for stream in streams.values():
+                stream['sink'].close()
+
+    def download(self, file_name, repetitions, bar, record, stop=lambda: False):
+        if self.concurrency > 1:
+            self.download_concurrently(file_name, repetitions, self.concurrency, bar, record, stop)
+        else:
             for i in bar:
+                if stop():
+                    break
                 result = self.download_file(file_name)
                 if result:
-                    results.append(result)
+                    record(result)
+
+    def run_experiment(self, file_name, repetitions, completed=None, warmup=0, stopping_rule=None):
+        accumulator = ExperimentAccumulator(file_name, self.max_raw_samples)
+        for result in completed or []:
+            accumulator.add(result)
+        remaining = repetitions - accumulator.count
+        
+        def record(result):
+            accumulator.add(result)
+            if self.results_log:
+                self.results_log.append({"file_name": file_name, **result})
+        
+        if remaining > 0 and warmup > 0:
+            with ProgressDisplay.create_progress_bar(f"{file_name} (warmup)", warmup) as bar:
+                self.download(file_name, warmup, bar, lambda result: None)
         
-        if not results:
+        if remaining > 0:
+            stop = lambda: False
+            if stopping_rule:
+                stopping_rule.start()
+                stop = lambda: stopping_rule.reached(accumulator)
+            with ProgressDisplay.create_progress_bar(file_name, remaining) as bar:
+                self.download(file_name, remaining, bar, record, stop)
+            if stopping_rule and stopping_rule.reason:
+                click.echo(click.style(f"Stopped after {accumulator.count} repetitions: {stopping_rule.reason}",
+                                       fg='yellow'))
+        
+        if accumulator.count == 0:
             click.echo(click.style(f"❌ All download attempts failed for {file_name}", 
                                   fg='bright_red', bold=True))
             return None
         
-        summary = Statistics.process_experiment_results(results, file_name)
+        summary = accumulator.summary()
         Statistics.print_experiment_summary(file_name, summary)
         return summary
 
-    def run_experiments(self, server, file_prefix, experiments=None):
+    def run_experiments(self, server, file_prefix, experiments=None, output_dir=None, resume=False,
+                        stopping_rule=None):
         if experiments is None:
             experiments = ExperimentConfig.get_default_experiments()
         
         results_data = ResultsManager.initialize_results(
-            self.protocol_name, server, file_prefix
+            self.protocol_name, server, file_prefix, self.concurrency
         )
         
         if not self.open_connection():
             return results_data
         
+        log_path = ResultsManager.log_filepath(ResultsManager.results_filepath(
+            results_data, self.protocol_name, file_prefix, server, output_dir
+        ))
+        completed = ResultsLog.completed_by_file(log_path) if resume else {}
+        self.results_log = ResultsLog(log_path, resume=resume)
+        
         try:
             for exp in experiments:
                 file_name = f"{file_prefix}_{exp['size']}"
-                results = self.run_experiment(file_name, exp['repetitions'])
+                results = self.run_experiment(file_name, exp['repetitions'], completed.get(file_name),
+                                              exp.get('warmup', 0), stopping_rule)
                 
                 if results:
                     results_data["files"][file_name] = results
                 
         finally:
             self.close_connection()
+            self.results_log.close()
         
         return results_data
 
@@ -179,12 +323,43 @@ machine_config = ExperimentConfig.load_machine_config()
 @click.command()
 @click.option('--server', type=click.Choice(list(machine_config)), required=True, 
               help='Server to connect to')
-@click.option('--file', type=click.Choice(['A', 'B']), required=True,
+@click.option('--file', type=click.Choice(ExperimentConfig.get_file_prefixes()), required=True,
               help='File prefix to request (A or B)')
-def main(server, file):
+@click.option('--concurrency', type=click.IntRange(min=1), default=1, show_default=True,
+              help='Number of streams kept in flight on the connection')
+@click.option('--sink', type=click.Choice(ResponseSink.KINDS), default='count', show_default=True,
+              help='What to do with response bodies: count bytes, keep them in memory, '
+                   'write them to downloads/, or SHA-256 hash them while streaming')
+@click.option('--max-raw-samples', type=click.IntRange(min=0), default=1000, show_default=True,
+              help='Raw per-request results kept per file (a uniform random sample beyond this)')
+@click.option('--resume', is_flag=True, default=False,
+              help='Continue an interrupted run from its results log instead of starting over')
+@click.option('--port', type=int, default=8000, show_default=True,
+              help='Server port')
+@click.option('--scale', type=click.FloatRange(min=0, min_open=True), default=1.0, show_default=True,
+              help='Multiply the number of repetitions of every file size (at least 1 each)')
+@click.option('--output-dir', type=click.Path(file_okay=False), default=current_dir,
+              help='Directory the results files are written to (default: next to the client)')
+@click.option('--size', 'sizes', type=click.Choice(list(ExperimentConfig.get_size_labels().values())), multiple=True,
+              help='File sizes to download (repeatable, default: every non-optional size in files/manifest.json)')
+@click.option('--spec', 'spec_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Experiment spec file: sizes, repetitions, warmup, concurrency levels, time budget '
+                   'and adaptive stopping (see specs/default.json)')
+@click.option('--warmup', type=click.IntRange(min=0), default=None,
+              help='Untimed downloads of each file before the measured ones (default: from --spec, else 0)')
+def main(server, file, concurrency, sink, max_raw_samples, resume, port, scale, output_dir, sizes, spec_path, warmup):
     server_ip = ExperimentConfig.get_server_ip(machine_config, server)
-    client = HTTP2Client(server_ip)
-    results_data = client.run_experiments(server, file)
-    ResultsManager.save_results(results_data, "HTTP/2", file, server, current_dir)
+    spec = ExperimentSpec.load(spec_path, "http2")
+    if warmup is not None:
+        spec.warmup = warmup
+    experiments = spec.experiments(scale, sizes)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # a spec can sweep concurrency levels, each saved to its own results file
+    for level in spec.concurrency or [concurrency]:
+        client = HTTP2Client(server_ip, port, concurrency=level, sink=sink, max_raw_samples=max_raw_samples)
+        results_data = client.run_experiments(server, file, experiments, output_dir=output_dir, resume=resume,
+                                              stopping_rule=spec.stopping_rule())
+        ResultsManager.save_results(results_data, "HTTP/2", file, server, output_dir)
 
 main()
\ No newline at end of file
@@ -1,26 +1,46 @@
 import socket
 import os
+import mmap
+import asyncio
+import collections
+import click
 import h2.connection
 import h2.config
+import h2.events
+import h2.exceptions
+import h2.settings
 
 FILE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "files")
 
+def map_file(file_path):
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None  # empty files cannot be mapped
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def create_connection():
+    config = h2.config.H2Configuration(client_side=False)
+    conn = h2.connection.H2Connection(config=config)
+    conn.local_settings = h2.settings.Settings(client=False, initial_values={h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 2**31 - 1})
+    return conn
+
+
 class HTTPServer:
-    def __init__(self):
+    def __init__(self, port=8000):
+        self.port = port
         self.sock = socket.socket()
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(("0.0.0.0", 8000))
+        self.sock.bind(("0.0.0.0", port))
         self.sock.listen(1)
 
     def start(self):
-        print(f"Serving HTTP on 0.0.0.0 port 8000 (http://0.0.0.0:8000/)")
+        print(f"Serving HTTP on 0.0.0.0 port {self.port} (http://0.0.0.0:{self.port}/)")
         while True:
             self.handle(self.sock.accept()[0])
 
     def handle(self, sock):
-        config = h2.config.H2Configuration(client_side=False)
-        conn = h2.connection.H2Connection(config=config)
-        conn.local_settings = h2.settings.Settings(client=False, initial_values={h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 2**31 - 1})
+        conn = create_connection()
         conn.initiate_connection()
         sock.sendall(conn.data_to_send())
 
@@ -40,10 +60,15 @@ class HTTPServer:
                     
                     file_name = path[1:]
                     file_path = os.path.join(FILE_FOLDER, file_name)
-                    with open(file_path, "rb") as file:
-                        response_data = file.read()
-
-                    self.send_successfull_response(conn,sock, event, response_data)
+                    mapped = map_file(file_path)
+                    # DATA frames are sliced straight out of the page cache
+                    response_data = memoryview(mapped) if mapped is not None else b""
+                    try:
+                        self.send_successfull_response(conn,sock, event, response_data)
+                    finally:
+                        if mapped is not None:
+                            response_data.release()
+                            mapped.close()
 
 
     def send_successfull_response(self, conn,sock, event, response_data):
@@ -80,4 +105,192 @@ class HTTPServer:
         sock.sendall(conn.data_to_send())
 
 
-HTTPServer().start()
+class H2Stream:
+    """A response body being sent from a memory-mapped file."""
+
+    def __init__(self, stream_id, file_path):
+        self.stream_id = stream_id
+        self.mapped = map_file(file_path)
+        self.body = memoryview(self.mapped) if self.mapped is not None else b""
+        self.offset = 0
+
+    @property
+    def remaining(self):
+        return len(self.body) - self.offset
+
+    def next_chunk(self, size):
+        chunk = self.body[self.offset : self.offset + size]
+        self.offset += size
+        return chunk
+
+    def close(self):
+        if self.mapped is not None:
+            self.body.release()
+            self.mapped.close()
+            self.mapped = None
+
+
+class H2ConnectionHandler:
+    """Serves one client connection.
+
+    Requests are read by one task while a second task sends the responses.
+    Streams with data to send are served round-robin, one DATA frame per
+    turn, and a stream whose flow-control window is exhausted is parked
+    until the client sends a WINDOW_UPDATE instead of blocking the others.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.conn = create_connection()
+        self.streams = {}
+        self.ready = collections.deque()
+        self.blocked = set()
+        self.has_work = asyncio.Event()
+
+    async def run(self):
+        self.conn.initiate_connection()
+        await self.flush()
+        sender = asyncio.create_task(self.send_loop())
+        try:
+            await self.receive_loop()
+        except ConnectionError:
+            pass
+        except h2.exceptions.ProtocolError:
+            # h2 has queued a GOAWAY for the misbehaving client; send it before closing
+            sender.cancel()
+            try:
+                await self.flush()
+            except ConnectionError:
+                pass
+        finally:
+            sender.cancel()
+            for stream in self.streams.values():
+                stream.close()
+            self.streams.clear()
+            self.writer.close()
+
+    async def flush(self):
+        data = self.conn.data_to_send()
+        if data:
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def receive_loop(self):
+        while True:
+            data = await self.reader.read(65535)
+            if not data:
+                return
+
+            for event in self.conn.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    self.open_stream(event)
+                elif isinstance(event, (h2.events.WindowUpdated, h2.events.RemoteSettingsChanged)):
+                    self.unblock()
+                elif isinstance(event, h2.events.StreamReset):
+                    self.close_stream(event.stream_id)
+                elif isinstance(event, h2.events.ConnectionTerminated):
+                    await self.flush()
+                    return
+            await self.flush()
+
+    def open_stream(self, event):
+        stream_id = event.stream_id
+        path = dict(event.headers)[b':path'].decode()
+        file_path = os.path.join(FILE_FOLDER, path[1:])
+        if not os.path.isfile(file_path):
+            self.conn.send_headers(stream_id, [(":status", "404"), ("content-length", "0")], end_stream=True)
+            return
+
+        stream = H2Stream(stream_id, file_path)
+        self.conn.send_headers(
+            stream_id=stream_id,
+            headers=[
+                (":status", "200"),
+                ("server", "basic-h2-server/1.0"),
+                ("content-length", str(len(stream.body))),
+                ("content-type", "text/html"),
+            ],
+        )
+        self.streams[stream_id] = stream
+        self.schedule(stream_id)
+
+    def close_stream(self, stream_id):
+        stream = self.streams.pop(stream_id, None)
+        if stream is not None:
+            stream.close()
+        self.blocked.discard(stream_id)
+
+    def schedule(self, stream_id):
+        self.ready.append(stream_id)
+        self.has_work.set()
+
+    def unblock(self):
+        self.ready.extend(self.blocked)
+        self.blocked.clear()
+        self.has_work.set()
+
+    async def send_loop(self):
+        while True:
+            if not self.ready:
+                self.has_work.clear()
+                await self.has_work.wait()
+                continue
+
+            stream_id = self.ready.popleft()
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                continue
+
+            try:
+                size = min(stream.remaining,
+                           self.conn.local_flow_control_window(stream_id),
+                           self.conn.max_outbound_frame_size)
+                if size > 0:
+                    self.conn.send_data(stream_id, stream.next_chunk(size))
+
+                if stream.remaining == 0:
+                    self.conn.end_stream(stream_id)
+                    self.close_stream(stream_id)
+                elif size > 0:
+                    self.ready.append(stream_id)
+                else:
+                    self.blocked.add(stream_id)
+            except h2.exceptions.StreamClosedError:
+                self.close_stream(stream_id)
+
+            await self.flush()
+
+
+class AsyncHTTPServer:
+    def __init__(self, port=8000):
+        self.port = port
+
+    async def handle(self, reader, writer):
+        await H2ConnectionHandler(reader, writer).run()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, "0.0.0.0", self.port, backlog=128, reuse_address=True)
+        print(f"Serving HTTP on 0.0.0.0 port {self.port} (http://0.0.0.0:{self.port}/)")
+        async with server:
+            await server.serve_forever()
+
+    def start(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Server stopped.")
+
+
+@click.command()
+@click.option('--port', type=int, default=8000, show_default=True,
+              help='Port to listen on')
+@click.option('--engine', type=click.Choice(['asyncio', 'sync']), default='asyncio', show_default=True,
+              help='asyncio serves many connections and streams at once; sync serves one connection at a time')
+def main(port, engine):
+    if engine == 'asyncio':
+        AsyncHTTPServer(port).start()
+    else:
+        HTTPServer(port).start()
+
+main()
@@ -0,0 +1,177 @@
+import asyncio
+import random
+import click
+
+CHUNK_SIZE = 16 * 1024
+PACKET_SIZE = 1460  # loss is drawn per MSS-sized packet of each chunk
+QUEUE_CHUNKS = 64   # chunks buffered per direction before the sender is pushed back
+MIN_RTO = 0.2       # Linux never retransmits sooner than 200 ms
+
+
+class Link:
+    """One direction of an emulated network path, shared by every connection through it.
+
+    A chunk is first serialised onto the link at the bandwidth cap, then
+    delivered after the one-way delay plus jitter. The delivery times of
+    one connection never go backwards, so its bytes stay in order as they
+    would on TCP. A lost packet stalls its connection for one
+    retransmission timeout instead of being dropped, since the proxy sits
+    above TCP and cannot drop it.
+    """
+
+    def __init__(self, delay=0.0, jitter=0.0, bandwidth=None, loss=0.0, rto=MIN_RTO, rng=None):
+        self.delay = delay
+        self.jitter = jitter
+        self.bandwidth = bandwidth  # bits per second, None for unlimited
+        self.loss = loss
+        self.rto = rto
+        self.rng = rng or random.Random()
+        self.link_free = 0.0
+
+    def schedule(self, size, now, last_delivery=0.0):
+        """Return the time a chunk of size bytes arriving at now is delivered.
+
+        last_delivery is the delivery time of the previous chunk on the same connection.
+        """
+        departure = max(now, self.link_free)
+        if self.bandwidth:
+            departure += size * 8 / self.bandwidth
+        self.link_free = departure
+
+        delivery = departure + self.delay
+        if self.jitter:
+            delivery += self.rng.uniform(0, self.jitter)
+        if self.loss:
+            packets = -(-size // PACKET_SIZE)
+            if self.rng.random() < 1 - (1 - self.loss) ** packets:
+                delivery += self.rto
+        return max(delivery, last_delivery)
+
+
+class NetemProxy:
+    """TCP proxy that forwards every connection to a target through two emulated links."""
+
+    def __init__(self, listen_port, target_host, target_port, rtt=0.0, jitter=0.0, bandwidth=None,
+                 loss=0.0, seed=None, listen_host="127.0.0.1"):
+        self.listen_host = listen_host
+        self.listen_port = listen_port
+        self.target_host = target_host
+        self.target_port = target_port
+        self.rtt = rtt
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.rng = random.Random(seed)
+        # one link per direction, so concurrent connections share the bandwidth cap
+        self.upstream = self.create_link()
+        self.downstream = self.create_link()
+
+    def create_link(self):
+        return Link(self.rtt / 2, self.jitter / 2, self.bandwidth, self.loss,
+                    max(MIN_RTO, 2 * self.rtt), self.rng)
+
+    async def pipe(self, reader, writer, link, hold_until=0.0):
+        """Forward reader to writer through link; no chunk enters the link before hold_until."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=QUEUE_CHUNKS)
+
+        async def read():
+            last_delivery = 0.0
+            while data := await reader.read(CHUNK_SIZE):
+                last_delivery = link.schedule(len(data), max(loop.time(), hold_until), last_delivery)
+                await queue.put((last_delivery, data))
+            await queue.put((loop.time(), None))
+
+        async def deliver():
+            while True:
+                delivery, data = await queue.get()
+                if data is None:
+                    break
+                delay = delivery - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+
+        def read_done(task):
+            # nothing feeds the queue once reading failed, e.g. on a reset reader
+            if not task.cancelled() and task.exception() is not None:
+                delivery_task.cancel()
+
+        read_task = asyncio.create_task(read())
+        delivery_task = asyncio.create_task(deliver())
+        read_task.add_done_callback(read_done)
+        # delivery ends after the last chunk, or fails, e.g. on a reset writer; either
+        # way nothing drains the queue any more, so reading must not block on it
+        delivery_task.add_done_callback(lambda task: read_task.cancel())
+        try:
+            # a connection error on either side only ends this direction
+            await asyncio.gather(read_task, delivery_task, return_exceptions=True)
+        finally:
+            read_task.cancel()
+            delivery_task.cancel()
+
+    async def handle(self, client_reader, client_writer):
+        try:
+            server_reader, server_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        except OSError as e:
+            print(f"Could not reach {self.target_host}:{self.target_port}: {e}")
+            client_writer.close()
+            return
+
+        # the client's handshake with the proxy completed locally, so charge the
+        # missing SYN/SYN-ACK round trip to the first bytes it sends
+        handshake_done = asyncio.get_running_loop().time() + self.rtt
+        
+        try:
+            await asyncio.gather(
+                self.pipe(client_reader, server_writer, self.upstream, handshake_done),
+                self.pipe(server_reader, client_writer, self.downstream),
+            )
+        finally:
+            for writer in (client_writer, server_writer):
+                writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.listen_host, self.listen_port, reuse_address=True)
+        print(f"Proxying {self.listen_host}:{self.listen_port} -> {self.target_host}:{self.target_port} "
+              f"[{self.describe()}]")
+        async with server:
+            await server.serve_forever()
+
+    def describe(self):
+        bandwidth = f"{self.bandwidth / 1e6:g} Mbit/s" if self.bandwidth else "unlimited"
+        return (f"rtt {self.rtt * 1000:g} ms, jitter {self.jitter * 1000:g} ms, "
+                f"bandwidth {bandwidth}, loss {self.loss:g}")
+
+    def start(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Proxy stopped.")
+
+
+@click.command()
+@click.option('--port', type=int, required=True,
+              help='Port to listen on')
+@click.option('--target', required=True,
+              help='host:port of the server to forward to')
+@click.option('--rtt', type=click.FloatRange(min=0), default=0.0, show_default=True,
+              help='Round-trip time to add, in milliseconds (half in each direction)')
+@click.option('--jitter', type=click.FloatRange(min=0), default=0.0, show_default=True,
+              help='Extra random round-trip delay of up to this many milliseconds')
+@click.option('--bandwidth', type=click.FloatRange(min=0, min_open=True), default=None,
+              help='Bandwidth cap in Mbit/s for each direction (default: unlimited)')
+@click.option('--loss', type=click.FloatRange(min=0, max=1, max_open=True), default=0.0, show_default=True,
+              help='Packet loss probability; each lost packet stalls the stream for one retransmission timeout')
+@click.option('--seed', type=int, default=None,
+              help='Random seed for reproducible jitter and loss')
+def main(port, target, rtt, jitter, bandwidth, loss, seed):
+    host, _, target_port = target.rpartition(':')
+    NetemProxy(port, host or "127.0.0.1", int(target_port), rtt / 1000, jitter / 1000,
+               bandwidth * 1e6 if bandwidth else None, loss, seed).start()
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,21 @@ import time
 import os
 import json
 import math
+import hashlib
+import random
+import signal
+import socket
+import subprocess
+from contextlib import contextmanager
 import click
+import numpy as np
 from statistics import mean, stdev
 
 class Statistics:
+    # per-request metrics that only some clients record
+    OPTIONAL_METRICS = ["connect_time", "latency", "time_to_first_byte"]
+    TRIM = 0.1  # fraction cut from each end for the trimmed mean
+
     @staticmethod
     def calculate_statistics(values):
         n = len(values)
@@ -22,45 +33,49 @@ class Statistics:
         
         return {"mean": mean_val, "stddev": stddev}
     
+    @staticmethod
+    def robust_statistics(values, trim=TRIM):
+        """Median, median absolute deviation and trimmed mean, which a few outliers barely move."""
+        values = np.sort(np.asarray(values, dtype=float))
+        if len(values) == 0:
+            return {"median": 0, "mad": 0, "trimmed_mean": 0}
+        
+        median = float(np.median(values))
+        cut = int(len(values) * trim)
+        return {
+            "median": median,
+            "mad": float(np.median(np.abs(values - median))),
+            "trimmed_mean": float(values[cut:len(values) - cut].mean()),
+        }
+    
     @staticmethod
     def process_experiment_results(results, file_name):
         if not results:
             return None
-            
-        transfer_times = [r['transfer_time'] for r in results]
-        throughputs = [r['throughput'] for r in results]
-        overhead_ratios = [r['overhead_ratio'] for r in results]
-        
-        time_stats = Statistics.calculate_statistics(transfer_times)
-        throughput_stats = Statistics.calculate_statistics(throughputs)
-        overhead_stats = Statistics.calculate_statistics(overhead_ratios)
-        
-        summary = {
-            "file_name": file_name,
-            "file_size_bytes": results[0]['file_size'],
-            "repetitions_completed": len(results),
-            "transfer_time": {
-                "mean": time_stats["mean"],
-                "stddev": time_stats["stddev"]
-            },
-            "throughput_bps": {
-                "mean": throughput_stats["mean"],
-                "stddev": throughput_stats["stddev"]
-            },
-            "overhead_ratio": {
-                "mean": overhead_stats["mean"],
-                "stddev": overhead_stats["stddev"]
-            },
-            "raw_results": results
-        }
         
-        return summary
+        accumulator = ExperimentAccumulator(file_name, max_raw_samples=None)
+        for result in results:
+            accumulator.add(result)
+        return accumulator.summary()
     
     @staticmethod
     def print_experiment_summary(file_name, summary):
         click.echo(f"Avg transfer time:" + 
                   click.style(f" {summary['transfer_time']['mean']:.6f}s", fg="magenta") +
                   click.style(f" (±{summary['transfer_time']['stddev']:.6f})", fg='blue'))
+        if 'p50' in summary['transfer_time']:
+            click.echo(f"Transfer time percentiles:" +
+                      click.style(" " + "  ".join(f"{name} {summary['transfer_time'][name]:.6f}s"
+                                                  for name in RunningStatistics.QUANTILES), fg="magenta"))
+        if 'median' in summary['transfer_time']:
+            click.echo(f"Robust transfer time:" +
+                      click.style(f" median {summary['transfer_time']['median']:.6f}s"
+                                  f"  MAD {summary['transfer_time']['mad']:.6f}s"
+                                  f"  trimmed mean {summary['transfer_time']['trimmed_mean']:.6f}s", fg="magenta"))
+            sample_size = summary['transfer_time'].get('robust_sample_size')
+            if sample_size is not None and sample_size < summary.get('repetitions_completed', sample_size):
+                click.echo(click.style(f"Median is the p50 estimate; MAD and trimmed mean are from a sample of {sample_size} of "
+                                       f"{summary['repetitions_completed']} repetitions (--max-raw-samples)", fg='yellow'))
         
         throughput_kb = summary['throughput_bps']['mean']/1024
         click.echo(f"Avg throughput:" + 
@@ -70,6 +85,242 @@ class Statistics:
         click.echo(f"Avg overhead ratio:" + 
                   click.style(f" {summary['overhead_ratio']['mean']:.6f}", fg="magenta") +
                   click.style(f" (±{summary['overhead_ratio']['stddev']:.6f})", fg='blue'))
+        
+        for metric in Statistics.OPTIONAL_METRICS:
+            if metric in summary:
+                label = metric.replace('_', ' ')
+                click.echo(f"Avg {label}:" + 
+                          click.style(f" {summary[metric]['mean']:.6f}s", fg="magenta") +
+                          click.style(f" (±{summary[metric]['stddev']:.6f})", fg='blue'))
+
+
+class QuantileSketch:
+    """Streaming quantile estimates in bounded memory.
+
+    Values are counted in logarithmically sized buckets, so any quantile is
+    returned within relative_accuracy of the true value whatever the number
+    of samples, and the number of buckets only grows with the value range.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0  # values <= 0 have no logarithm
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if value <= 0:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return self.min
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                estimate = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+
+class RunningStatistics:
+    """Single-pass mean/stddev (Welford's algorithm) plus tail percentiles."""
+    QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.sketch = QuantileSketch()
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.sketch.add(value)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0
+
+    def relative_ci(self, z=1.96):
+        """Half-width of the confidence interval of the mean, relative to the mean."""
+        if self.count < 2 or self.mean == 0:
+            return math.inf
+        return z * self.stddev / math.sqrt(self.count) / abs(self.mean)
+
+    def summary(self):
+        summary = {"mean": self.mean, "stddev": self.stddev}
+        for name, q in RunningStatistics.QUANTILES.items():
+            summary[name] = self.sketch.quantile(q)
+        return summary
+
+
+class Reservoir:
+    """Uniform random sample of at most size items from a stream (size=None keeps all)."""
+
+    def __init__(self, size=None):
+        self.size = size
+        self.items = []
+        self.seen = 0
+        self.random = random.Random()
+
+    def add(self, item):
+        self.seen += 1
+        if self.size is None or len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            slot = self.random.randrange(self.seen)
+            if slot < self.size:
+                self.items[slot] = item
+
+
+class ExperimentAccumulator:
+    """Builds an experiment summary from results as they arrive.
+
+    Clients add each repetition's result as soon as it completes. Memory stays
+    flat however many repetitions run, because only running statistics and a
+    bounded reservoir of raw results are kept.
+    """
+    METRICS = {"transfer_time": "transfer_time", "throughput": "throughput_bps", "overhead_ratio": "overhead_ratio"}
+
+    def __init__(self, file_name, max_raw_samples=1000):
+        self.file_name = file_name
+        self.file_size = None
+        self.count = 0
+        self.metrics = {}
+        self.phases = {}
+        self.raw_results = Reservoir(max_raw_samples)
+
+    def add(self, result):
+        if self.file_size is None:
+            self.file_size = result['file_size']
+        self.count += 1
+        for metric in list(ExperimentAccumulator.METRICS) + Statistics.OPTIONAL_METRICS:
+            if metric in result:
+                self.metrics.setdefault(metric, RunningStatistics()).add(result[metric])
+        for phase, duration in result.get('phases', {}).items():
+            self.phases.setdefault(phase, RunningStatistics()).add(duration)
+        self.raw_results.add(result)
+
+    def summary(self):
+        if self.count == 0:
+            return None
+        
+        summary = {
+            "file_name": self.file_name,
+            "file_size_bytes": self.file_size,
+            "repetitions_completed": self.count,
+        }
+        # robust statistics come from the raw results kept; while they hold every
+        # repetition the median is exact, after that the sketch's p50 stands in for it
+        raw_results = self.raw_results.items
+        for metric, key in ExperimentAccumulator.METRICS.items():
+            summary[key] = self.metrics[metric].summary()
+            summary[key].update(Statistics.robust_statistics([result[metric] for result in raw_results]),
+                                robust_sample_size=len(raw_results))
+            if len(raw_results) < self.count:
+                summary[key]["median"] = summary[key]["p50"]
+        
+        # optional metrics and phases are only summarised when every result has them
+        for metric in Statistics.OPTIONAL_METRICS:
+            if metric in self.metrics and self.metrics[metric].count == self.count:
+                summary[metric] = self.metrics[metric].summary()
+        if self.phases and all(stats.count == self.count for stats in self.phases.values()):
+            summary["phases"] = {phase: stats.summary() for phase, stats in self.phases.items()}
+        
+        summary["raw_results"] = raw_results
+        return summary
+
+
+class StoppingRule:
+    """Ends an experiment before all its repetitions ran.
+
+    It stops once time_budget seconds have passed, or adaptively once the
+    95% confidence interval of the metric's mean is within relative_ci of
+    the mean (after at least min_repetitions).
+    """
+
+    def __init__(self, time_budget=None, relative_ci=None, min_repetitions=30, metric="transfer_time"):
+        self.time_budget = time_budget
+        self.relative_ci = relative_ci
+        self.min_repetitions = min_repetitions
+        self.metric = metric
+        self.reason = None
+        self.start()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.reason = None
+
+    def reached(self, accumulator):
+        if self.time_budget is not None and time.perf_counter() - self.started >= self.time_budget:
+            self.reason = f"time budget of {self.time_budget}s used up"
+            return True
+        stats = accumulator.metrics.get(self.metric)
+        if self.relative_ci is not None and stats and stats.count >= self.min_repetitions:
+            if stats.relative_ci() <= self.relative_ci:
+                self.reason = f"95% CI of {self.metric} within ±{self.relative_ci:.1%}"
+                return True
+        return False
+
+
+class ExperimentSpec:
+    """Experiment matrix read from a JSON spec file, see specs/default.json.
+
+    Top-level keys apply to every protocol; the entry for a protocol under
+    "overrides" replaces them for that protocol only.
+    """
+    PROTOCOLS = ["http1.1", "http2", "bittorrent"]
+
+    def __init__(self, spec=None, protocol=None):
+        spec = dict(spec or {})
+        spec.update(spec.pop("overrides", {}).get(protocol, {}))
+        self.protocols = spec.get("protocols", ExperimentSpec.PROTOCOLS)
+        self.sizes = spec.get("sizes")  # label -> repetitions; None uses files/manifest.json
+        self.warmup = spec.get("warmup", 0)
+        self.concurrency = spec.get("concurrency")
+        self.time_budget = spec.get("time_budget")
+        self.adaptive = spec.get("adaptive")
+
+    @staticmethod
+    def load(spec_path=None, protocol=None):
+        if spec_path is None:
+            return ExperimentSpec(protocol=protocol)
+        with open(spec_path, 'r') as f:
+            return ExperimentSpec(json.load(f), protocol)
+
+    def experiments(self, scale=1.0, sizes=None):
+        if self.sizes is None:
+            experiments = ExperimentConfig.get_default_experiments(scale, sizes)
+        else:
+            experiments = [
+                {"size": label, "repetitions": max(1, round(repetitions * scale))}
+                for label, repetitions in self.sizes.items()
+                if not sizes or label in sizes
+            ]
+        for exp in experiments:
+            exp["warmup"] = self.warmup
+        return experiments
+
+    def stopping_rule(self):
+        if self.time_budget is None and not self.adaptive:
+            return None
+        return StoppingRule(self.time_budget, **(self.adaptive or {}))
 
 
 class ExperimentConfig:
@@ -77,7 +328,7 @@ class ExperimentConfig:
     def load_machine_config(config_path=None):
         if config_path is None:
             current_dir = os.path.dirname(os.path.abspath(__file__))
-            config_path = os.path.join(current_dir, "machines.json")
+            config_path = os.environ.get("MACHINES_CONFIG", os.path.join(current_dir, "machines.json"))
         
         try:
             with open(config_path, 'r') as f:
@@ -97,41 +348,327 @@ class ExperimentConfig:
         return server_ip
     
     @staticmethod
-    def get_default_experiments():
+    def load_file_manifest(manifest_path=None):
+        """The test file matrix shared by the generator, the clients and the analysis."""
+        if manifest_path is None:
+            current_dir = os.path.dirname(os.path.abspath(__file__))
+            manifest_path = os.path.join(current_dir, "files", "manifest.json")
+        
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    
+    @staticmethod
+    def get_file_prefixes():
+        return ExperimentConfig.load_file_manifest()["prefixes"]
+    
+    @staticmethod
+    def get_size_labels():
+        return {size["bytes"]: size["label"] for size in ExperimentConfig.load_file_manifest()["sizes"]}
+    
+    @staticmethod
+    def get_default_experiments(scale=1.0, sizes=None):
+        # optional sizes (100MB, 1GB) only run when asked for explicitly
         return [
-            {"size": "10kB", "repetitions": 1000},
-            {"size": "100kB", "repetitions": 100},
-            {"size": "1MB", "repetitions": 10},
-            {"size": "10MB", "repetitions": 1}
+            {"size": size["label"], "repetitions": max(1, round(size["repetitions"] * scale))}
+            for size in ExperimentConfig.load_file_manifest()["sizes"]
+            if (size["label"] in sizes if sizes else not size.get("optional", False))
         ]
 
 
 class ResultsManager:
     @staticmethod
-    def initialize_results(protocol, server, file_prefix):
+    def initialize_results(protocol, server, file_prefix, concurrency=1):
         return {
             "protocol": protocol,
             "server": server,
             "file_prefix": file_prefix,
+            "concurrency": concurrency,
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
             "files": {}
         }
     
     @staticmethod
-    def save_results(results_data, protocol, file_prefix, server, output_dir=None):
+    def results_filepath(results_data, protocol, file_prefix, server, output_dir=None):
         if output_dir is None:
             output_dir = os.path.dirname(os.path.abspath(__file__))
         
-        result_filename = f"results_{file_prefix}_from_{server}_{protocol.replace('/', '')}.json"
-        result_filepath = os.path.join(output_dir, result_filename)
+        # keep concurrent runs from overwriting the sequential results
+        suffix = ""
+        if results_data.get("mode", "sequential") != "sequential":
+            suffix += f"_{results_data['mode']}"
+        if results_data.get("concurrency", 1) > 1:
+            suffix += f"_c{results_data['concurrency']}"
+        result_filename = f"results_{file_prefix}_from_{server}_{protocol.replace('/', '')}{suffix}.json"
+        return os.path.join(output_dir, result_filename)
+    
+    @staticmethod
+    def log_filepath(result_filepath):
+        return result_filepath[:-len(".json")] + "_log.jsonl"
+    
+    @staticmethod
+    def raw_dirpath(result_filepath):
+        return result_filepath[:-len(".json")] + "_raw"
+    
+    @staticmethod
+    def save_results(results_data, protocol, file_prefix, server, output_dir=None):
+        result_filepath = ResultsManager.results_filepath(results_data, protocol, file_prefix, server, output_dir)
+        
+        # the JSON file is a small manifest of summaries; raw samples go to one .npy file per column
+        raw_dirpath = ResultsManager.raw_dirpath(result_filepath)
+        manifest = ResultsManager.save_raw_results(results_data, raw_dirpath)
         
         with open(result_filepath, 'w') as f:
-            json.dump(results_data, f, indent=2)
+            json.dump(manifest, f, indent=2)
         
         click.echo(click.style(f"\nResults saved to {result_filepath}", 
                               fg='bright_green', bold=True))
         
         return result_filepath
+    
+    @staticmethod
+    def flatten_result(result):
+        """Numeric and string fields of one raw result; nested dicts such as phases become "phases.connect"."""
+        row = {}
+        for key, value in result.items():
+            if isinstance(value, dict):
+                for sub_key, sub_value in value.items():
+                    if isinstance(sub_value, (int, float, str)):
+                        row[f"{key}.{sub_key}"] = sub_value
+            elif isinstance(value, (int, float, str)):
+                row[key] = value
+        return row
+    
+    @staticmethod
+    def save_raw_results(results_data, raw_dirpath):
+        """Write every file's raw_results into raw_dirpath, one 1-D .npy file per column.
+
+        Each numeric field becomes a float64 column (NaN where a result lacks
+        it), and each string field, such as the sha256 digest, a fixed-width
+        UTF-8 byte column (b"" where missing). The rows of all files follow one
+        another; returns a copy of results_data without the raw results, where
+        each file entry records its row range instead.
+        """
+        rows = []
+        manifest = {**results_data, "files": {}}
+        for file_name, summary in results_data["files"].items():
+            start = len(rows)
+            rows.extend(ResultsManager.flatten_result(r) for r in summary.get("raw_results", []))
+            manifest["files"][file_name] = {key: value for key, value in summary.items() if key != "raw_results"}
+            manifest["files"][file_name]["raw_results_rows"] = [start, len(rows)]
+        
+        os.makedirs(raw_dirpath, exist_ok=True)
+        # a previous save may have written columns these results do not have
+        for name in os.listdir(raw_dirpath):
+            if name.endswith(".npy"):
+                os.remove(os.path.join(raw_dirpath, name))
+        for column in sorted({column for row in rows for column in row}):
+            values = [row.get(column) for row in rows]
+            if any(isinstance(value, str) for value in values):
+                array = np.array([b"" if value is None else str(value).encode() for value in values])
+            else:
+                array = np.array([np.nan if value is None else value for value in values], dtype="f8")
+            np.save(os.path.join(raw_dirpath, f"{column}.npy"), array)
+        
+        manifest["raw_results_dir"] = os.path.basename(raw_dirpath)
+        return manifest
+    
+    @staticmethod
+    def load_raw_results(result_filepath, file_name=None):
+        """Memory-map the raw samples behind a results manifest.
+
+        Returns a dict of column name -> 1-D array, each read from disk on
+        demand, or None for older results files that still embed raw_results.
+        """
+        with open(result_filepath, 'r') as f:
+            manifest = json.load(f)
+        if "raw_results_dir" not in manifest:
+            return None
+        
+        raw_dirpath = os.path.join(os.path.dirname(result_filepath), manifest["raw_results_dir"])
+        rows = slice(*manifest["files"][file_name]["raw_results_rows"]) if file_name is not None else slice(None)
+        return {name[:-len(".npy")]: np.load(os.path.join(raw_dirpath, name), mmap_mode='r')[rows]
+                for name in sorted(os.listdir(raw_dirpath)) if name.endswith(".npy")}
+
+
+class ResultsLog:
+    """Append-only JSON Lines checkpoint written as repetitions complete.
+
+    Each record is one line, so appending costs the same however long the run
+    has been going. Records are fsynced every fsync_every appends, and a line
+    cut short by a crash is skipped when the log is read back.
+    """
+
+    def __init__(self, path, resume=False, fsync_every=50):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.unsynced = 0
+        if resume:
+            ResultsLog.truncate_partial_line(path)
+        self.file = open(path, 'a' if resume else 'w')
+
+    def append(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+    @staticmethod
+    def truncate_partial_line(path, block_size=4096):
+        """Cut a line left unfinished by a crash, so the next record starts on a line of its own."""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r+b') as f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - block_size)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b"\n")
+                if newline >= 0:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position < end:
+                f.truncate(position)
+
+    @staticmethod
+    def read(path):
+        if not os.path.exists(path):
+            return []
+        records = []
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass  # partially written last line
+        return records
+
+    @staticmethod
+    def completed_by_file(path):
+        completed = {}
+        for record in ResultsLog.read(path):
+            file_name = record.pop("file_name", None)
+            completed.setdefault(file_name, []).append(record)
+        return completed
+
+
+class PhaseTimer:
+    """Timestamps the phases of one transfer on the monotonic perf_counter_ns clock.
+
+    Each phase lasts from the previous mark (or the start) to its own mark, so
+    the phases add up to the whole transfer. A phase that never happened, such
+    as connect on a reused connection, is reported as 0.
+    """
+    PHASES = ["connect", "request_sent", "first_byte", "body_complete", "teardown"]
+
+    def __init__(self, start_ns=None):
+        self.start_ns = time.perf_counter_ns() if start_ns is None else start_ns
+        self.marks = {}
+
+    def mark(self, phase):
+        self.marks[phase] = time.perf_counter_ns()
+
+    def elapsed(self, phase):
+        return (self.marks[phase] - self.start_ns) / 1e9
+
+    def phases(self):
+        durations = {}
+        previous = self.start_ns
+        for phase in PhaseTimer.PHASES:
+            if phase in self.marks:
+                durations[phase] = (self.marks[phase] - previous) / 1e9
+                previous = self.marks[phase]
+            else:
+                durations[phase] = 0.0
+        return durations
+
+
+class ResponseSink:
+    KINDS = ["buffer", "count", "file", "hash"]
+
+    def __init__(self):
+        self.bytes_received = 0
+
+    def write(self, data):
+        self.bytes_received += len(data)
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def create(kind, name=None, size_hint=0, output_dir="downloads"):
+        if kind == "count":
+            return ResponseSink()
+        if kind == "buffer":
+            return BufferSink(size_hint)
+        if kind == "file":
+            return FileSink(os.path.join(output_dir, name))
+        if kind == "hash":
+            return HashSink()
+        raise ValueError(f"Unknown response sink: {kind}")
+
+
+class BufferSink(ResponseSink):
+    """Keeps the body in memory, in a buffer preallocated from Content-Length."""
+
+    def __init__(self, size_hint=0):
+        super().__init__()
+        self.buffer = bytearray(size_hint)
+
+    def write(self, data):
+        end = self.bytes_received + len(data)
+        if end <= len(self.buffer):
+            self.buffer[self.bytes_received:end] = data
+        else:
+            del self.buffer[self.bytes_received:]
+            self.buffer += data
+        self.bytes_received = end
+
+    @property
+    def data(self):
+        return memoryview(self.buffer)[:self.bytes_received]
+
+
+class FileSink(ResponseSink):
+    """Streams the body to disk so memory use does not grow with file size."""
+
+    def __init__(self, path):
+        super().__init__()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+        self.bytes_received += len(data)
+
+    def close(self):
+        self.file.close()
+
+
+class HashSink(ResponseSink):
+    """Hashes the body as it streams in, without keeping it."""
+
+    def __init__(self, algorithm="sha256"):
+        super().__init__()
+        self.hash = hashlib.new(algorithm)
+
+    def write(self, data):
+        self.hash.update(data)
+        self.bytes_received += len(data)
+
+    @property
+    def hexdigest(self):
+        return self.hash.hexdigest()
 
 
 class ProgressDisplay:
@@ -142,4 +679,60 @@ class ProgressDisplay:
             range(repetitions), 
             label=click.style(f'Downloading {file_name} x {repetitions}', fg='bright_green'),
             item_show_func=lambda i: f"Iteration {i+1}/{repetitions}" if i is not None else ""
-        )
\ No newline at end of file
+        )
+
+
+class Processes:
+    """Helpers for starting the servers and peers of a local experiment as background processes."""
+
+    STARTUP_TIMEOUT = 30
+
+    @staticmethod
+    def free_port():
+        # let the kernel pick an ephemeral port; it is released again for the server to bind
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+
+    @staticmethod
+    def wait_for_port(port, process, timeout=STARTUP_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise click.ClickException(f"Process exited with code {process.returncode} before listening on {port}")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise click.ClickException(f"Nothing listening on port {port} after {timeout}s")
+
+    @staticmethod
+    def wait_for_line(log_path, prefix, process, timeout=STARTUP_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with open(log_path, 'r') as f:
+                for line in f:
+                    if line.startswith(prefix):
+                        return line.strip()
+            if process.poll() is not None:
+                raise click.ClickException(f"Process exited before printing {prefix!r}, see {log_path}")
+            time.sleep(0.1)
+        raise click.ClickException(f"No {prefix!r} line in {log_path} after {timeout}s")
+
+    @staticmethod
+    @contextmanager
+    def running(command, log_path, env, cwd=None):
+        """Run a server in the background, and stop it with Ctrl+C so it saves its results."""
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env, cwd=cwd)
+        try:
+            yield process
+        finally:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+                try:
+                    process.wait(timeout=Processes.STARTUP_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()